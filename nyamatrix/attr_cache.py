@@ -0,0 +1,126 @@
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+from importlib import metadata
+from pathlib import Path
+
+
+def _calculator_version() -> str:
+    """
+    The installed rosu-pp-py build. It is installed from a git fork whose formula can change without a version bump,
+    so the version is qualified by the commit it was installed from, or by a hash of the extension module.
+    """
+    try:
+        dist = metadata.distribution("rosu-pp-py")
+    except metadata.PackageNotFoundError:
+        return "rosu-pp-py unknown"
+    direct_url = json.loads(dist.read_text("direct_url.json") or "{}")
+    if commit := direct_url.get("vcs_info", {}).get("commit_id"):
+        return f"rosu-pp-py {dist.version} {commit}"
+    digest = hashlib.md5()
+    for file in sorted(dist.files or [], key=str):
+        if file.suffix in (".so", ".pyd"):
+            digest.update(file.read_binary())
+    return f"rosu-pp-py {dist.version} {digest.hexdigest()}"
+
+
+CALCULATOR_VERSION = _calculator_version()
+
+# Score state: mods, combo, n_geki, n300, n_katu, n100, n50, misses
+ScoreState = tuple[int, int, int, int, int, int, int, int]
+
+STATEMENT_CREATE_TABLE = """
+CREATE TABLE IF NOT EXISTS performance (
+    beatmap_hash TEXT NOT NULL,
+    mode INTEGER NOT NULL,
+    version TEXT NOT NULL,
+    state TEXT NOT NULL,
+    pp REAL NOT NULL,
+    stars REAL NOT NULL,
+    last_used INTEGER NOT NULL,
+    PRIMARY KEY (beatmap_hash, mode, version, state)
+)"""
+STATEMENT_CREATE_INDEX = "CREATE INDEX IF NOT EXISTS performance_last_used ON performance (last_used)"
+STATEMENT_LOOKUP = "SELECT state, pp, stars FROM performance WHERE beatmap_hash = ? AND mode = ? AND version = ?"
+STATEMENT_TOUCH = "UPDATE performance SET last_used = ? WHERE beatmap_hash = ? AND mode = ? AND version = ? AND last_used < ?"
+STATEMENT_STORE = "INSERT OR REPLACE INTO performance VALUES (?, ?, ?, ?, ?, ?, ?)"
+STATEMENT_COUNT = "SELECT COUNT(*) FROM performance"
+STATEMENT_EVICT = "DELETE FROM performance WHERE rowid IN (SELECT rowid FROM performance ORDER BY last_used LIMIT ?)"
+
+# Entries used within this window are not touched again, keeps lookups mostly read-only.
+TOUCH_INTERVAL = 3600
+
+
+def _encode_state(state: ScoreState) -> str:
+    return ",".join(str(v) for v in state)
+
+
+def _decode_state(state: str) -> ScoreState:
+    return tuple(int(v) for v in state.split(","))  # type: ignore
+
+
+class AttributeCache:
+    """
+    Persistent SQLite cache of calculated results across recalc runs.
+    Entries are keyed by (.osu content hash, converted mode, calculator version, score state) and hold the final pp
+    and star rating, not difficulty attributes: rosu-pp-py attribute objects can not be rebuilt from Python.
+    A map whose file did not change is neither parsed nor calculated again. The calculator version includes the
+    installed rosu-pp-py commit (see _calculator_version), so a formula change misses the cache instead of serving stale pp.
+    Every thread (and every process, the cache pickles to its settings) opens its own connection.
+    """
+
+    def __init__(self, path: str | Path, max_entries: int):
+        self.path = str(path)
+        self.max_entries = max_entries
+        self._local = threading.local()
+
+    def __getstate__(self):
+        return {"path": self.path, "max_entries": self.max_entries}
+
+    def __setstate__(self, state):
+        self.__init__(state["path"], state["max_entries"])
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=60)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(STATEMENT_CREATE_TABLE)
+            conn.execute(STATEMENT_CREATE_INDEX)
+            conn.commit()
+            self._local.conn = conn
+        return conn
+
+    def lookup(self, beatmap_hash: str, mode: int) -> dict[ScoreState, tuple[float, float]]:
+        rows = self._conn().execute(STATEMENT_LOOKUP, (beatmap_hash, mode, CALCULATOR_VERSION))
+        return {_decode_state(state): (pp, stars) for state, pp, stars in rows}
+
+    def store(self, beatmap_hash: str, mode: int, entries: dict[ScoreState, tuple[float, float]]) -> None:
+        now = int(time.time())
+        conn = self._conn()
+        with conn:
+            conn.execute(STATEMENT_TOUCH, (now, beatmap_hash, mode, CALCULATOR_VERSION, now - TOUCH_INTERVAL))
+            conn.executemany(
+                STATEMENT_STORE,
+                [
+                    (beatmap_hash, mode, CALCULATOR_VERSION, _encode_state(state), pp, stars, now)
+                    for state, (pp, stars) in entries.items()
+                ],
+            )
+
+    def evict(self) -> int:
+        """
+        Drop the least recently used entries until the cache fits max_entries again.
+        """
+        conn = self._conn()
+        excess = conn.execute(STATEMENT_COUNT).fetchone()[0] - self.max_entries
+        if excess <= 0:
+            return 0
+        with conn:
+            conn.execute(STATEMENT_EVICT, (excess,))
+        logging.info(f"Evicted {excess} entries from attribute cache.")
+        return excess
@@ -0,0 +1,71 @@
+import hashlib
+import logging
+import os
+import time
+from pathlib import Path
+
+
+class BeatmapIndex:
+    """
+    Listing of the .osu files in --beatmap-path, built once at startup with a single directory scan,
+    so workers never stat or probe the (possibly network backed) beatmap store for missing maps.
+    Maps id to (size, mtime), content hashes are filled in as files are read.
+    """
+
+    def __init__(self, path: str | Path, entries: dict[int, tuple[int, float]]):
+        self.path = Path(path)
+        self.entries = entries
+        self.hashes: dict[int, str] = {}
+
+    @classmethod
+    def scan(cls, path: str | Path) -> "BeatmapIndex":
+        started = time.perf_counter()
+        entries: dict[int, tuple[int, float]] = {}
+        with os.scandir(path) as it:
+            for entry in it:
+                stem, ext = os.path.splitext(entry.name)
+                if ext == ".osu" and stem.isdigit() and entry.is_file():
+                    stat = entry.stat()
+                    entries[int(stem)] = (stat.st_size, stat.st_mtime)
+        logging.info(f"Indexed {len(entries)} beatmaps in {path} ({time.perf_counter() - started:.1f}s).")
+        return cls(path, entries)
+
+    def __contains__(self, map_id: int) -> bool:
+        return map_id in self.entries
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def refresh(self, map_id: int) -> bool:
+        """
+        Look up a map that was not there at scan time, e.g. downloaded while a watch is running.
+        """
+        try:
+            stat = (self.path / f"{map_id}.osu").stat()
+        except FileNotFoundError:
+            return False
+        self.entries[map_id] = (stat.st_size, stat.st_mtime)
+        return True
+
+    def read(self, map_id: int) -> tuple[bytes, str]:
+        """
+        Read a beatmap file, returns its content and md5 hash.
+        """
+        content = (self.path / f"{map_id}.osu").read_bytes()
+        self.hashes[map_id] = beatmap_hash = hashlib.md5(content).hexdigest()
+        return content, beatmap_hash
+
+
+def report_missing(missing: list[int], output: str | Path | None = None) -> None:
+    """
+    Log the maps that had scores but no .osu file, and optionally write their ids to a file, one per line.
+    """
+    if not missing:
+        return
+    missing = sorted(missing)
+    if output:
+        Path(output).write_text("".join(f"{map_id}\n" for map_id in missing))
+        logging.warning(f"{len(missing)} maps with scores have no .osu file, ids written to {output}.")
+    else:
+        shown = ", ".join(str(map_id) for map_id in missing[:50])
+        logging.warning(f"{len(missing)} maps with scores have no .osu file: {shown}{', ...' if len(missing) > 50 else ''}")
@@ -0,0 +1,383 @@
+import hashlib
+import json
+import logging
+import platform
+import random
+import threading
+import time
+from collections import Counter
+from concurrent.futures import Future
+from pathlib import Path
+from typing import Any, Iterator, Optional
+from sqlalchemy import Engine, create_engine, text
+
+from nyamatrix import enums, processor
+from nyamatrix.attr_cache import CALCULATOR_VERSION
+from nyamatrix.metrics import Metrics
+from nyamatrix.pipeline import InflightLimiter
+from nyamatrix.user_stats import iter_user_stats
+
+# Score modes are drawn from this list, so most scores are vanilla osu! like on a real server.
+SCORE_MODES = [0, 0, 0, 0, 0, 4, 4, 1, 2, 3, 8]
+MODS = [0, 0, 0, 8, 16, 64, 72, 24, 128, 2, 1]
+GRADES = ["XH", "X", "SH", "S", "A", "B", "C", "D"]
+LOAD_CHUNK_SIZE = 10000
+
+STATEMENTS_CREATE_TABLES = [
+    "CREATE TABLE IF NOT EXISTS maps (id INT NOT NULL PRIMARY KEY, md5 CHAR(32) NOT NULL, mode TINYINT NOT NULL, "
+    "status TINYINT NOT NULL, KEY maps_md5 (md5))",
+    "CREATE TABLE IF NOT EXISTS scores (id BIGINT UNSIGNED NOT NULL PRIMARY KEY, map_md5 CHAR(32) NOT NULL, "
+    "score INT NOT NULL, pp FLOAT, acc FLOAT NOT NULL, max_combo INT NOT NULL, mods INT NOT NULL, "
+    "n300 INT NOT NULL, n100 INT NOT NULL, n50 INT NOT NULL, nmiss INT NOT NULL, ngeki INT NOT NULL, nkatu INT NOT NULL, "
+    "grade VARCHAR(2) NOT NULL, status TINYINT NOT NULL, mode TINYINT NOT NULL, time INT NOT NULL, "
+    "time_elapsed INT NOT NULL, userid INT NOT NULL, KEY scores_map_md5 (map_md5), KEY scores_userid (userid))",
+    "CREATE TABLE IF NOT EXISTS stats (id INT NOT NULL, mode TINYINT NOT NULL, tscore BIGINT NOT NULL DEFAULT 0, "
+    "rscore BIGINT NOT NULL DEFAULT 0, pp INT NOT NULL DEFAULT 0, plays INT NOT NULL DEFAULT 0, "
+    "playtime INT NOT NULL DEFAULT 0, acc FLOAT NOT NULL DEFAULT 0, max_combo INT NOT NULL DEFAULT 0, "
+    "total_hits INT NOT NULL DEFAULT 0, xh_count INT NOT NULL DEFAULT 0, x_count INT NOT NULL DEFAULT 0, "
+    "sh_count INT NOT NULL DEFAULT 0, s_count INT NOT NULL DEFAULT 0, a_count INT NOT NULL DEFAULT 0, PRIMARY KEY (id, mode))",
+    "CREATE TABLE IF NOT EXISTS users (id INT NOT NULL PRIMARY KEY, country CHAR(2) NOT NULL, priv INT NOT NULL)",
+]
+STATEMENT_COUNT_SCORES = "SELECT COUNT(*) FROM scores"
+STATEMENTS_CLEAR_TABLES = ["DELETE FROM scores", "DELETE FROM maps", "DELETE FROM stats", "DELETE FROM users"]
+STATEMENT_INSERT_MAP = "INSERT INTO maps (id, md5, mode, status) VALUES (:id, :md5, 0, 2)"
+STATEMENT_INSERT_SCORE = (
+    "INSERT INTO scores (id, map_md5, score, pp, acc, max_combo, mods, n300, n100, n50, nmiss, ngeki, nkatu, grade, status, "
+    "mode, time, time_elapsed, userid) VALUES (:id, :map_md5, :score, :pp, :acc, :max_combo, :mods, :n300, :n100, :n50, "
+    ":nmiss, :ngeki, :nkatu, :grade, 1, :mode, :time, :time_elapsed, :userid)"
+)
+STATEMENT_INSERT_USER = "INSERT INTO users (id, country, priv) VALUES (:id, :country, :priv)"
+STATEMENT_INSERT_STATS = "INSERT INTO stats (id, mode) VALUES (:id, :mode)"
+
+
+class Dataset:
+    """
+    Deterministic synthetic bancho.py dataset: maps with generated .osu files, and scores spread over them with a
+    Zipf-like skew (map i gets a share proportional to 1 / i^skew), so a few maps hold most scores over a long tail.
+    Everything is derived from the seed and the map id, so maps can be generated one at a time.
+    """
+
+    def __init__(self, maps: int, scores: int, users: int, skew: float, seed: int):
+        self.maps = maps
+        self.scores = scores
+        self.users = users
+        self.skew = skew
+        self.seed = seed
+        weights = [1 / (i + 1) ** skew for i in range(maps)]
+        total = sum(weights)
+        self.counts = [max(1, round(scores * w / total)) for w in weights]
+
+    def params(self) -> dict[str, Any]:
+        return {
+            "maps": self.maps,
+            "scores": sum(self.counts),
+            "users": self.users,
+            "skew": self.skew,
+            "seed": self.seed,
+            "largest_map_scores": max(self.counts),
+        }
+
+    def objects(self, map_id: int) -> int:
+        return random.Random(self.seed * 1_000_003 + map_id).randint(200, 1500)
+
+    def beatmap(self, map_id: int) -> bytes:
+        """
+        A playable osu!standard map of circles and linear sliders.
+        """
+        rng = random.Random(self.seed * 1_000_003 + map_id)
+        objects = rng.randint(200, 1500)
+        lines = [
+            "osu file format v14",
+            "",
+            "[General]",
+            "AudioFilename: audio.mp3",
+            "Mode: 0",
+            "",
+            "[Difficulty]",
+            f"HPDrainRate:{rng.randint(3, 7)}",
+            f"CircleSize:{rng.choice([3, 3.5, 4, 4.2, 5])}",
+            f"OverallDifficulty:{rng.randint(5, 10)}",
+            f"ApproachRate:{rng.randint(7, 10)}",
+            "SliderMultiplier:1.4",
+            "SliderTickRate:1",
+            "",
+            "[TimingPoints]",
+            f"0,{rng.choice([250, 300, 333.33, 400])},4,2,0,100,1,0",
+            "",
+            "[HitObjects]",
+        ]
+        t = 1000
+        for _ in range(objects):
+            x, y = rng.randint(0, 512), rng.randint(0, 384)
+            if rng.random() < 0.3:
+                lines.append(f"{x},{y},{t},2,0,L|{(x + 100) % 512}:{y},1,100")
+                t += rng.choice([300, 450, 600])
+            else:
+                lines.append(f"{x},{y},{t},1,0")
+                t += rng.choice([75, 150, 150, 300])
+        return ("\n".join(lines) + "\n").encode()
+
+    def write_beatmaps(self, path: Path) -> dict[int, str]:
+        """
+        Write every map to <path>/<id>.osu, returns the md5 of each map.
+        """
+        path.mkdir(parents=True, exist_ok=True)
+        hashes: dict[int, str] = {}
+        for map_id in range(1, self.maps + 1):
+            content = self.beatmap(map_id)
+            (path / f"{map_id}.osu").write_bytes(content)
+            hashes[map_id] = hashlib.md5(content).hexdigest()
+        return hashes
+
+    def iter_scores(self, map_id: int, first_id: int) -> Iterator[dict[str, Any]]:
+        rng = random.Random(self.seed * 7_919 + map_id)
+        objects = self.objects(map_id)
+        for score_id in range(first_id, first_id + self.counts[map_id - 1]):
+            misses = min(objects, int(rng.expovariate(0.3)))
+            n100 = min(objects - misses, int(rng.expovariate(0.05)))
+            n50 = min(objects - misses - n100, int(rng.expovariate(0.5)))
+            yield {
+                "id": score_id,
+                "mode": rng.choice(SCORE_MODES),
+                "mods": rng.choice(MODS),
+                "max_combo": rng.randint(1, objects) if misses else objects,
+                "ngeki": 0,
+                "n300": objects - misses - n100 - n50,
+                "nkatu": 0,
+                "n100": n100,
+                "n50": n50,
+                "nmiss": misses,
+                "pp": round(rng.uniform(0, 400), 3),
+                "score": rng.randint(10_000, 10_000_000),
+                "acc": round(rng.uniform(80, 100), 3),
+                "grade": rng.choice(GRADES),
+                "time": score_id,
+                "time_elapsed": rng.randint(30_000, 300_000),
+                # Squared to skew plays towards a core of active users.
+                "userid": int(self.users * rng.random() ** 2) + 1,
+            }
+
+    def iter_maps(self) -> Iterator[tuple[int, Iterator[dict[str, Any]]]]:
+        first_id = 1
+        for map_id in range(1, self.maps + 1):
+            yield map_id, self.iter_scores(map_id, first_id)
+            first_id += self.counts[map_id - 1]
+
+
+class MemoryConnection:
+    """
+    Writer stand-in that drops every statement.
+    """
+
+    def __enter__(self) -> "MemoryConnection":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        pass
+
+    def execute(self, statement: Any, params: Any = None) -> None:
+        pass
+
+    def commit(self) -> None:
+        pass
+
+
+class MemoryEngine:
+    def connect(self) -> MemoryConnection:
+        return MemoryConnection()
+
+
+class NullRedis:
+    """
+    Redis stand-in for the leaderboard writer, drops every command.
+    """
+
+    def pipeline(self, transaction: bool = True) -> "NullRedis":
+        return self
+
+    def scan_iter(self, *args, **kwargs) -> Iterator[str]:
+        return iter(())
+
+    def exists(self, *keys) -> int:
+        return 0
+
+    def __getattr__(self, name: str):
+        return lambda *args, **kwargs: None
+
+
+def _rates(wall: float, stats: Counter) -> dict[str, Any]:
+    return {
+        "wall_seconds": round(wall, 3),
+        "groups": stats["groups"],
+        "scores": stats["scores"],
+        "groups_per_second": round(stats["groups"] / wall, 1) if wall else None,
+        "scores_per_second": round(stats["scores"] / wall, 1) if wall else None,
+        "beatmap_parses": stats["beatmap_parses"],
+        "parse_seconds": round(stats["parse_seconds"], 3),
+        "convert_seconds": round(stats["convert_seconds"], 3),
+        "calc_seconds": round(stats["calc_seconds"], 3),
+        "write_seconds": round(stats["write_seconds"], 3),
+        "errors": stats["errors"],
+    }
+
+
+def _bench_scores_memory(dataset: Dataset, beatmap_path: Path, workers: int, executor: enums.ExecutorKind) -> dict[str, Any]:
+    """
+    Drive _process_map over the generated groups without a database, writes go to a MemoryEngine.
+    """
+    stats: Counter = Counter()
+    stats_lock = threading.Lock()
+    engine = MemoryEngine()
+    limiter = InflightLimiter(max_groups=256)
+
+    def on_done(future: Future, scores_num: int) -> None:
+        limiter.release(scores_num)
+        with stats_lock:
+            stats.update(future.result()[0])
+
+    started = time.perf_counter()
+    # Process workers get the MemoryEngine with every task, the pool's own engine is never connected.
+    with processor._create_executor(create_engine("sqlite://"), executor, workers) as pool:
+        for map_id, scores in dataset.iter_maps():
+            groups: dict[int, list] = {}
+            for score in scores:
+                groups.setdefault(score["mode"], []).append(
+                    (
+                        score["id"],
+                        score["mods"],
+                        score["max_combo"],
+                        score["ngeki"],
+                        score["n300"],
+                        score["nkatu"],
+                        score["n100"],
+                        score["n50"],
+                        score["nmiss"],
+                        score["pp"],
+                    )
+                )
+            content = (beatmap_path / f"{map_id}.osu").read_bytes()
+            scores_num = sum(len(group) for group in groups.values())
+            limiter.acquire(scores_num)
+            future = pool.submit(processor._process_map, map_id, groups, content, hashlib.md5(content).hexdigest(), engine)
+            future.add_done_callback(lambda f, n=scores_num: on_done(f, n))
+    return _rates(time.perf_counter() - started, stats)
+
+
+def _bench_user_stats_memory(dataset: Dataset) -> dict[str, Any]:
+    """
+    Time the streaming user pp engine over every score as if it were a best score.
+    """
+    bests = sorted(
+        ((score["userid"], score["mode"], score["pp"], score["acc"]) for _, scores in dataset.iter_maps() for score in scores),
+        key=lambda row: (row[0], row[1], -row[2], -row[3]),
+    )
+    keys = sorted({(row[0], row[1]) for row in bests})
+    started = time.perf_counter()
+    rows = sum(1 for _ in iter_user_stats(keys, bests))
+    wall = time.perf_counter() - started
+    return {"wall_seconds": round(wall, 3), "users": rows, "users_per_second": round(rows / wall, 1) if wall else None}
+
+
+def load_dataset(engine: Engine, dataset: Dataset, hashes: dict[int, str], reset: bool = False) -> None:
+    """
+    Create the bancho.py tables nyamatrix touches (if missing) and load the dataset into them.
+    Refuses to touch a database that already has scores unless reset is set, which clears the tables first.
+    """
+    with engine.connect() as conn:
+        for statement in STATEMENTS_CREATE_TABLES:
+            conn.execute(text(statement))
+        if conn.execute(text(STATEMENT_COUNT_SCORES)).scalar():
+            if not reset:
+                raise RuntimeError("The benchmark database already has scores, pass --reset to clear it.")
+            for statement in STATEMENTS_CLEAR_TABLES:
+                conn.execute(text(statement))
+        conn.execute(text(STATEMENT_INSERT_MAP), [{"id": map_id, "md5": md5} for map_id, md5 in hashes.items()])
+        conn.execute(
+            text(STATEMENT_INSERT_USER),
+            [{"id": user_id, "country": "xx", "priv": 1} for user_id in range(1, dataset.users + 1)],
+        )
+        conn.execute(
+            text(STATEMENT_INSERT_STATS),
+            [{"id": user_id, "mode": mode} for user_id in range(1, dataset.users + 1) for mode in sorted(set(SCORE_MODES))],
+        )
+        batch: list[dict[str, Any]] = []
+        for map_id, scores in dataset.iter_maps():
+            for score in scores:
+                score["map_md5"] = hashes[map_id]
+                batch.append(score)
+                if len(batch) >= LOAD_CHUNK_SIZE:
+                    conn.execute(text(STATEMENT_INSERT_SCORE), batch)
+                    batch = []
+        if batch:
+            conn.execute(text(STATEMENT_INSERT_SCORE), batch)
+        conn.commit()
+
+
+def run(
+    *,
+    beatmap_path: Path,
+    maps: int = 2000,
+    scores: int = 1_000_000,
+    users: int = 20000,
+    skew: float = 1.1,
+    seed: int = 1,
+    workers: int = 4,
+    executor: enums.ExecutorKind = enums.ExecutorKind.Thread,
+    engine: Optional[Engine] = None,
+    reset: bool = False,
+) -> dict[str, Any]:
+    """
+    Generate the dataset and time the score, status and user statistics stages.
+    Without an engine the scores run against an in-memory writer and status (which only exists as SQL) is skipped.
+    """
+    dataset = Dataset(maps, scores, users, skew, seed)
+    logging.info(f"Generating {maps} beatmaps in {beatmap_path}.")
+    started = time.perf_counter()
+    hashes = dataset.write_beatmaps(beatmap_path)
+    result: dict[str, Any] = {
+        "calculator_version": CALCULATOR_VERSION,
+        "python": platform.python_version(),
+        "backend": "mysql" if engine else "memory",
+        "workers": workers,
+        "executor": executor.value,
+        "dataset": dataset.params(),
+        "generate_seconds": round(time.perf_counter() - started, 3),
+    }
+
+    if engine is None:
+        logging.info("Benchmarking scores against the in-memory writer.")
+        result["scores"] = _bench_scores_memory(dataset, beatmap_path, workers, executor)
+        result["status"] = None
+        logging.info("Benchmarking the streaming user statistics engine.")
+        result["stats"] = _bench_user_stats_memory(dataset)
+        return result
+
+    logging.info("Loading the dataset into the database.")
+    started = time.perf_counter()
+    load_dataset(engine, dataset, hashes, reset)
+    result["load_seconds"] = round(time.perf_counter() - started, 3)
+
+    metrics = Metrics()
+    started = time.perf_counter()
+    processor.qb_process_scores(engine, str(beatmap_path), workers=workers, executor=executor, pp_epsilon=None, metrics=metrics)
+    result["scores"] = _rates(time.perf_counter() - started, metrics.counters)
+
+    started = time.perf_counter()
+    processor.qb_process_score_status(engine)
+    result["status"] = {"wall_seconds": round(time.perf_counter() - started, 3)}
+
+    result["stats"] = {}
+    for stats_engine in enums.StatsEngine:
+        started = time.perf_counter()
+        processor.qb_process_user_statistics(engine, NullRedis(), calc_pp=True, stats_engine=stats_engine)  # type: ignore[arg-type]
+        result["stats"][stats_engine.value] = {"wall_seconds": round(time.perf_counter() - started, 3)}
+    return result
+
+
+def write_result(result: dict[str, Any], output: Optional[str] = None) -> None:
+    payload = json.dumps(result, indent=2)
+    if output:
+        Path(output).write_text(payload + "\n")
+        logging.info(f"Benchmark results written to {output}.")
+    else:
+        print(payload)
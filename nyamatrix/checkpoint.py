@@ -0,0 +1,122 @@
+import json
+import logging
+import threading
+from collections import defaultdict, deque
+from pathlib import Path
+from typing import Any
+
+
+class Checkpoint:
+    """
+    Append-only journal of the maps a recalc has finished, so a crashed run can be resumed.
+    Every group stream reads one map id range in ascending order and is identified by the first id of its range.
+    "D <id>" lines record finished maps and "W <start> <id>" lines a stream's watermark: every map from start up to id
+    was finished. "M <id>" lines record maps skipped for a missing .osu file, the watermark moves past them
+    but they are not done, a resume reads them again (see missing). A resumed stream continues after the watermarks covering its start (see resume_after)
+    and skips the maps journaled as done beyond them. A map can be submitted to one stream and completed by another,
+    the maps read apart from their range are held in it this way, so its watermark can not pass them unfinished.
+    A journal written with different params is not resumed unless forced, its done maps would not cover the new scope.
+    """
+
+    def __init__(self, path: str | Path, params: dict[str, Any], resume: bool = False, force: bool = False):
+        self.path = Path(path)
+        self.done: set[int] = set()
+        self.missing: set[int] = set()
+        self._finished_ranges: list[tuple[int, int]] = []
+        self._pending: dict[int, deque[int]] = defaultdict(deque)
+        self._finished: set[int] = set()
+        self._lock = threading.Lock()
+
+        header = json.dumps(params, sort_keys=True, default=str)
+        if resume and self.path.exists():
+            self._load(header, force)
+            self._file = self.path.open("a")
+        else:
+            if resume:
+                logging.warning(f"No checkpoint at {self.path}, starting from the beginning.")
+            self._file = self.path.open("w")
+            self._file.write(f"# {header}\n")
+            self._file.flush()
+
+    def _load(self, header: str, force: bool) -> None:
+        with self.path.open() as f:
+            for line in f:
+                kind, _, value = line.rstrip("\n").partition(" ")
+                if kind == "#":
+                    if value != header:
+                        if not force:
+                            raise ValueError(
+                                f"Checkpoint {self.path} was written with different filters ({value}), "
+                                "rerun with the same filters, without --resume, or with --force to resume anyway."
+                            )
+                        logging.warning("Checkpoint was written with different filters, resuming anyway (--force).")
+                elif kind == "W":
+                    start, watermark = value.split(" ")
+                    self._finished_ranges.append((int(start), int(watermark)))
+                elif kind == "D":
+                    self.done.add(int(value))
+                    self.missing.discard(int(value))
+                elif kind == "M":
+                    self.missing.add(int(value))
+        self._finished_ranges.sort()
+        self.done = {map_id for map_id in self.done if not any(a <= map_id <= b for a, b in self._finished_ranges)}
+        logging.info(
+            f"Resuming with {len(self._finished_ranges)} finished map ranges, {len(self.done)} more maps already done "
+            f"and {len(self.missing)} maps to retry that had no .osu file."
+        )
+
+    def resume_after(self, start: int) -> int | None:
+        """
+        The highest map id such that every map from start up to it was finished by an earlier run, if any.
+        """
+        reach = start - 1
+        for a, b in self._finished_ranges:
+            if a > reach + 1:
+                break
+            reach = max(reach, b)
+        return reach if reach >= start else None
+
+    def finished(self, map_id: int) -> bool:
+        """
+        Whether an earlier run finished the map, journaled as done or behind a watermark and not missing.
+        """
+        if map_id in self.missing:
+            return False
+        return map_id in self.done or any(a <= map_id <= b for a, b in self._finished_ranges)
+
+    def submitted(self, stream: int, map_id: int) -> None:
+        with self._lock:
+            self._pending[stream].append(map_id)
+            # The map may have been completed by another stream already.
+            if self._advance(stream):
+                self._file.flush()
+
+    def completed(self, stream: int, map_id: int, missing: bool = False) -> None:
+        """
+        Journal a map as done, or as missing its .osu file, either way its stream's watermark can move past it.
+        """
+        with self._lock:
+            self._finished.add(map_id)
+            self._file.write(f"{'M' if missing else 'D'} {map_id}\n")
+            self._advance(stream)
+            for other in self._pending:
+                if other != stream:
+                    self._advance(other)
+            self._file.flush()
+
+    def _advance(self, stream: int) -> bool:
+        """
+        Journal the stream's new watermark if its oldest pending maps are finished, returns whether it moved.
+        """
+        pending = self._pending[stream]
+        watermark = None
+        while pending and pending[0] in self._finished:
+            self._finished.remove(pending[0])
+            watermark = pending.popleft()
+        if watermark is None:
+            return False
+        self._file.write(f"W {stream} {watermark}\n")
+        return True
+
+    def close(self) -> None:
+        self._file.close()
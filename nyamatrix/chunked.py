@@ -0,0 +1,49 @@
+import logging
+import time
+from typing import Any, Callable, Iterator
+from tqdm import tqdm
+from sqlalchemy import Engine, text
+
+STATEMENT_ID_BOUNDS = "SELECT MIN(id), MAX(id) FROM {table}"
+
+
+def id_ranges(engine: Engine, table: str, chunk_size: int) -> Iterator[tuple[int, int]]:
+    """
+    Split the primary key span of a table into inclusive [min, max] ranges of chunk_size ids.
+    """
+    with engine.connect() as conn:
+        lowest, highest = conn.execute(text(STATEMENT_ID_BOUNDS.format(table=table))).one()
+    if lowest is None:
+        return
+    for start in range(lowest, highest + 1, chunk_size):
+        yield start, min(start + chunk_size - 1, highest)
+
+
+def run_chunked(
+    engine: Engine,
+    chunks: list[Any],
+    build: Callable[[Any], tuple[str, dict]],
+    *,
+    sleep: float = 0,
+    size: Callable[[Any], int] = lambda chunk: 1,
+) -> None:
+    """
+    Run one UPDATE per chunk, each committed on its own so row locks are only held for a chunk at a time.
+    Sleeps between chunks to leave room for the live server's writes, progress is counted with size(chunk).
+    """
+    progress_bar = tqdm(total=sum(size(chunk) for chunk in chunks))
+    slowest = 0.0
+    with engine.connect() as conn:
+        for i, chunk in enumerate(chunks):
+            q, b = build(chunk)
+            started = time.perf_counter()
+            conn.execute(text(q), b)
+            conn.commit()
+            elapsed = time.perf_counter() - started
+            slowest = max(slowest, elapsed)
+            progress_bar.set_postfix(chunk=f"{elapsed:.2f}s", slowest=f"{slowest:.2f}s")
+            progress_bar.update(size(chunk))
+            if sleep and i + 1 < len(chunks):
+                time.sleep(sleep)
+    progress_bar.close()
+    logging.info(f"Ran {len(chunks)} chunks, the slowest held its locks for {slowest:.2f}s.")
@@ -1,4 +1,4 @@
-from enum import Enum, IntEnum
+from enum import Enum, IntEnum, IntFlag
 
 # Nyamatrix enums
 
@@ -15,6 +15,37 @@ class ReformTarget(Enum):
     ScoreStatus = "scores"
 
 
+class ExecutorKind(Enum):
+    Thread = "thread"
+    Process = "process"
+
+
+class FetchMode(Enum):
+    Json = "json"
+    Rows = "rows"
+
+
+class StatusChunk(Enum):
+    Off = "off"
+    Users = "users"
+    Maps = "maps"
+
+
+class StatsEngine(Enum):
+    Sql = "sql"
+    Stream = "stream"
+
+
+class MetricsFormat(Enum):
+    Prometheus = "prometheus"
+    Json = "json"
+
+
+class WriteMode(Enum):
+    Row = "row"
+    Bulk = "bulk"
+
+
 # BanchoPy enums
 
 
@@ -56,3 +87,34 @@ class MapStatus(Enum):
     Approved = "3"
     Qualified = "4"
     Loved = "5"
+
+
+class Mods(IntFlag):
+    NoFail = 1 << 0
+    Easy = 1 << 1
+    TouchDevice = 1 << 2
+    Hidden = 1 << 3
+    HardRock = 1 << 4
+    SuddenDeath = 1 << 5
+    DoubleTime = 1 << 6
+    Relax = 1 << 7
+    HalfTime = 1 << 8
+    Nightcore = 1 << 9
+    Flashlight = 1 << 10
+    SpunOut = 1 << 12
+    Autopilot = 1 << 13
+    Perfect = 1 << 14
+    Key4 = 1 << 15
+    Key5 = 1 << 16
+    Key6 = 1 << 17
+    Key7 = 1 << 18
+    Key8 = 1 << 19
+    FadeIn = 1 << 20
+    Random = 1 << 21
+    Key9 = 1 << 24
+    KeyCoop = 1 << 25
+    Key1 = 1 << 26
+    Key3 = 1 << 27
+    Key2 = 1 << 28
+    ScoreV2 = 1 << 29
+    Mirror = 1 << 30
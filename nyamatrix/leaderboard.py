@@ -0,0 +1,86 @@
+import logging
+from collections import defaultdict
+from redis import Redis
+
+LEADERBOARD_KEY = "bancho:leaderboard:{mode}"
+STAGING_PREFIX = "nyamatrix:rebuild:"
+
+
+class LeaderboardWriter:
+    """
+    Rebuilds bancho.py leaderboards next to the live ones and swaps them in at the end.
+    Members are sent as multi-member ZADDs in pipelines to staging keys, commit() renames every staging key
+    over its live key and drops live boards that got no members, all in one MULTI so readers never see a half-built board.
+    A partial writer (recalculating some users only) updates the live boards in place instead, adding and removing members.
+    """
+
+    def __init__(self, redis: Redis, modes: list[int], batch_size: int = 5000, partial: bool = False):
+        self.redis = redis
+        self.modes = modes
+        self.batch_size = batch_size
+        self.partial = partial
+        self.prefix = "" if partial else STAGING_PREFIX
+        self.pending: dict[str, dict[str, float]] = defaultdict(dict)
+        self.removals: dict[str, set[str]] = defaultdict(set)
+        self.pending_count = 0
+        self.built: set[str] = set()
+        # Leftovers of an interrupted rebuild would otherwise leak into this one.
+        stale = [] if partial else self._scan(STAGING_PREFIX + LEADERBOARD_KEY)
+        if stale:
+            self.redis.delete(*stale)
+
+    def _scan(self, prefix: str) -> list[str]:
+        keys: list[str] = []
+        for mode in self.modes:
+            board = prefix.format(mode=mode)
+            keys.extend(self.redis.scan_iter(match=f"{board}:*", count=1000))
+            if self.redis.exists(board):
+                keys.append(board)
+        return keys
+
+    def add(self, mode: int, country: str, user_id: int, pp: float) -> None:
+        board = LEADERBOARD_KEY.format(mode=mode)
+        self.pending[board][str(user_id)] = pp
+        self.pending[f"{board}:{country}"][str(user_id)] = pp
+        self.pending_count += 2
+        if self.pending_count >= self.batch_size:
+            self.flush()
+
+    def remove(self, mode: int, country: str, user_id: int) -> None:
+        """
+        Drop a user from the live boards, only meaningful for partial writers.
+        """
+        board = LEADERBOARD_KEY.format(mode=mode)
+        self.removals[board].add(str(user_id))
+        self.removals[f"{board}:{country}"].add(str(user_id))
+        self.pending_count += 2
+        if self.pending_count >= self.batch_size:
+            self.flush()
+
+    def flush(self) -> None:
+        if not self.pending_count:
+            return
+        pipe = self.redis.pipeline(transaction=False)
+        for key, members in self.pending.items():
+            pipe.zadd(self.prefix + key, members)
+            self.built.add(key)
+        for key, user_ids in self.removals.items():
+            pipe.zrem(key, *user_ids)
+        pipe.execute()
+        self.pending.clear()
+        self.removals.clear()
+        self.pending_count = 0
+
+    def commit(self) -> None:
+        self.flush()
+        if self.partial:
+            logging.info(f"Updated {len(self.built)} leaderboards in place.")
+            return
+        live = set(self._scan(LEADERBOARD_KEY))
+        pipe = self.redis.pipeline(transaction=True)
+        for key in live - self.built:
+            pipe.delete(key)
+        for key in self.built:
+            pipe.rename(STAGING_PREFIX + key, key)
+        pipe.execute()
+        logging.info(f"Swapped in {len(self.built)} leaderboards, dropped {len(live - self.built)} empty ones.")
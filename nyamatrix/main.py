@@ -1,11 +1,20 @@
 import coloredlogs
 import typer
 import logging
+from pathlib import Path
 from redis import Redis
 from sqlalchemy import create_engine
 from typing_extensions import Annotated
 
-from nyamatrix import enums, processor, statements
+from nyamatrix import bench as benchmark, enums, processor, statements
+from nyamatrix.attr_cache import AttributeCache
+from nyamatrix.beatmaps import BeatmapIndex
+from nyamatrix.checkpoint import Checkpoint
+from nyamatrix.manifest import Manifest
+from nyamatrix.metrics import Metrics
+from nyamatrix.shards import ShardCoordinator, parse_shard
+from nyamatrix.sinks import ResultSink
+from nyamatrix.watch import Watcher
 
 app = typer.Typer()
 
@@ -47,6 +56,144 @@ def recalc(
             help="Map status (" + ", ".join(f"{status.name}: {status.value}" for status in enums.MapStatus) + ")",
         ),
     ] = None,
+    user_ids: Annotated[list[int] | None, typer.Option("--user-ids", "-u", help="Only recalculate these users")] = None,
+    workers: Annotated[int, typer.Option("--workers", "-w", min=1, help="Number of pp calculation workers")] = 4,
+    executor: Annotated[
+        enums.ExecutorKind,
+        typer.Option(
+            "--executor",
+            "-e",
+            help="Worker pool kind. (" + ", ".join(f"{kind.name}: {kind.value}" for kind in enums.ExecutorKind) + ")",
+        ),
+    ] = enums.ExecutorKind.Thread.value,
+    max_inflight_groups: Annotated[
+        int, typer.Option("--max-inflight-groups", min=0, help="Max score groups queued for the workers, 0 for no limit")
+    ] = 256,
+    max_inflight_scores: Annotated[
+        int, typer.Option("--max-inflight-scores", min=0, help="Max scores queued for the workers, 0 for no limit")
+    ] = 0,
+    attr_cache_path: Annotated[
+        str | None,
+        typer.Option(
+            "--attr-cache",
+            help="Cache file of final pp and star ratings per score state (not difficulty attributes), "
+            "defaults to nyamatrix_cache.db next to the beatmaps directory",
+        ),
+    ] = None,
+    attr_cache_size: Annotated[
+        int, typer.Option("--attr-cache-size", min=0, help="Max attribute cache entries, 0 to disable the cache")
+    ] = 10_000_000,
+    write_mode: Annotated[
+        enums.WriteMode,
+        typer.Option(
+            "--write-mode",
+            help="How pp values are written. (" + ", ".join(f"{mode.name}: {mode.value}" for mode in enums.WriteMode) + ")",
+        ),
+    ] = enums.WriteMode.Row.value,
+    write_chunk_size: Annotated[int, typer.Option("--write-chunk-size", min=1, help="Rows per staging table chunk in bulk mode")] = 10000,
+    writer_threads: Annotated[
+        int, typer.Option("--writer-threads", min=0, help="Threads writing pp values, each on its own connection, 0 to write from the workers")
+    ] = 2,
+    write_queue_size: Annotated[int, typer.Option("--write-queue", min=1, help="Max computed maps waiting for a writer thread")] = 64,
+    write_flush_rows: Annotated[
+        int, typer.Option("--write-flush-rows", min=1, help="Rows a writer thread buffers across maps before committing them")
+    ] = 5000,
+    write_flush_seconds: Annotated[
+        float, typer.Option("--write-flush-seconds", min=0, help="Max seconds a writer thread buffers rows before committing them")
+    ] = 1.0,
+    pp_epsilon: Annotated[
+        float, typer.Option("--pp-epsilon", help="Only write scores whose pp moved by more than this, negative to write every score")
+    ] = 0.001,
+    checkpoint_path: Annotated[
+        str | None,
+        typer.Option("--checkpoint", help="Checkpoint journal, defaults to nyamatrix_checkpoint.log next to the beatmaps directory"),
+    ] = None,
+    resume: Annotated[bool, typer.Option("--resume", help="Resume the score recalc after the last checkpointed map")] = False,
+    force: Annotated[
+        bool, typer.Option("--force", help="Resume even if the checkpoint was written with different filters")
+    ] = False,
+    only_changed_maps: Annotated[
+        bool,
+        typer.Option(
+            "--changed-maps",
+            help="Only recalculate maps whose .osu file is new or changed since the manifest, and the users with scores on them",
+        ),
+    ] = False,
+    manifest_path: Annotated[
+        str | None,
+        typer.Option(
+            "--manifest",
+            help="Beatmap manifest, defaults to nyamatrix_manifest.txt next to the beatmaps directory, "
+            "only updated by runs without score filters or --shard",
+        ),
+    ] = None,
+    fetch_shards: Annotated[
+        int, typer.Option("--fetch-shards", min=1, help="Number of map id ranges whose scores are read in parallel")
+    ] = 1,
+    fetch_mode: Annotated[
+        enums.FetchMode,
+        typer.Option(
+            "--fetch-mode",
+            help="How scores are fetched. (" + ", ".join(f"{mode.name}: {mode.value}" for mode in enums.FetchMode) + ")",
+        ),
+    ] = enums.FetchMode.Json.value,
+    prefetch_workers: Annotated[int, typer.Option("--prefetch-workers", min=1, help="Threads reading .osu files ahead of the workers")] = 8,
+    split_scores: Annotated[
+        int,
+        typer.Option(
+            "--split-scores",
+            min=0,
+            help="Process maps with more scores than this first, largest first, in parts of this size, 0 to disable",
+        ),
+    ] = 20000,
+    shard: Annotated[
+        str | None,
+        typer.Option("--shard", help="Only recalculate slice INDEX (from 0) of COUNT, e.g. 0/4, on each of COUNT hosts"),
+    ] = None,
+    shard_run: Annotated[
+        str | None,
+        typer.Option("--shard-run", help="Run id shared by the hosts of a sharded recalc, the last to finish aggregates"),
+    ] = None,
+    missing_maps_output: Annotated[
+        str | None, typer.Option("--missing-maps", help="Write the ids of maps with scores but no .osu file to this file")
+    ] = None,
+    output: Annotated[
+        str | None,
+        typer.Option(
+            "--output",
+            "-o",
+            help="Dry run: write results to this .csv, .parquet or .arrow file instead of the database, see the apply command",
+        ),
+    ] = None,
+    status_chunk: Annotated[
+        enums.StatusChunk,
+        typer.Option(
+            "--status-chunk",
+            help="Recompute score status per batch of users or of the maps whose pp changed, off for one statement. ("
+            + ", ".join(f"{chunk.name}: {chunk.value}" for chunk in enums.StatusChunk)
+            + ")",
+        ),
+    ] = enums.StatusChunk.Maps.value,
+    status_chunk_size: Annotated[int, typer.Option("--status-chunk-size", min=1, help="Users or maps per status chunk")] = 1000,
+    stats_chunk_size: Annotated[
+        int, typer.Option("--stats-chunk-size", min=0, help="Users per stats UPDATE chunk, 0 for one statement")
+    ] = 0,
+    chunk_sleep: Annotated[
+        float, typer.Option("--chunk-sleep", min=0, help="Seconds to sleep between status and stats chunks")
+    ] = 0,
+    metrics_path: Annotated[
+        str | None, typer.Option("--metrics-file", help="Write run metrics to this file, e.g. a node_exporter textfile .prom")
+    ] = None,
+    metrics_format: Annotated[
+        enums.MetricsFormat,
+        typer.Option(
+            "--metrics-format",
+            help="Metrics file format. (" + ", ".join(f"{fmt.name}: {fmt.value}" for fmt in enums.MetricsFormat) + ")",
+        ),
+    ] = enums.MetricsFormat.Prometheus.value,
+    metrics_interval: Annotated[
+        float, typer.Option("--metrics-interval", min=0, help="Seconds between metrics file snapshots, 0 to write only at the end")
+    ] = 15,
     log_level: str = typer.Option("INFO", "--log-level", "-l", help="Logging level"),
 ):
     # Set up logging
@@ -56,6 +203,10 @@ def recalc(
     logging.basicConfig(level=numeric_level, format="%(asctime)s - %(levelname)s - %(message)s")
     coloredlogs.install(level="DEBUG")
 
+    shard_slice = parse_shard(shard) if shard else None
+    if shard_slice and not output and not shard_run:
+        raise ValueError("--shard needs a --shard-run id shared by every host of the run.")
+
     logging.info(f"Starting recalculation for game modes: {score_modes}")
     logging.debug(f"Using database URI: {mysql_uri}")
     logging.debug(f"Using Redis URI: {redis_uri}")
@@ -63,25 +214,155 @@ def recalc(
     if statements.test_database_connection(mysql_uri):
         engine = create_engine(mysql_uri, isolation_level="AUTOCOMMIT")
         redis_engine = Redis.from_url(redis_uri, decode_responses=True)
-        processor.qb_process_scores(
+        attr_cache = (
+            AttributeCache(attr_cache_path or Path(beatmap_path).resolve().parent / "nyamatrix_cache.db", attr_cache_size)
+            if attr_cache_size
+            else None
+        )
+        index = BeatmapIndex.scan(beatmap_path)
+        manifest = Manifest(manifest_path or Path(beatmap_path).resolve().parent / "nyamatrix_manifest.txt")
+        # A filtered or sharded run only recalculates some scores of a map (or some maps into a shared file),
+        # recording its maps would hide them from the next --changed-maps run.
+        update_manifest = not (map_modes or score_modes or score_status or map_status or user_ids or shard_slice or output)
+        map_ids = None
+        if only_changed_maps:
+            if manifest.entries:
+                map_ids = sorted(manifest.diff(index))
+                if not map_ids:
+                    logging.info("No beatmap changed since the manifest was saved, nothing to recalculate.")
+                    return
+            else:
+                logging.warning(f"No manifest at {manifest.path} yet, recalculating every map to create it.")
+        # A dry run rewrites its output from scratch, there is nothing to resume.
+        checkpoint = (
+            Checkpoint(
+                checkpoint_path or Path(beatmap_path).resolve().parent / "nyamatrix_checkpoint.log",
+                {
+                    "map_modes": map_modes,
+                    "score_modes": score_modes,
+                    "score_status": score_status,
+                    "map_status": map_status,
+                    "user_ids": user_ids,
+                    "changed_maps": only_changed_maps,
+                    "shard": shard,
+                    "split_scores": split_scores,
+                },
+                resume=resume,
+                force=force,
+            )
+            if not output
+            else None
+        )
+        coordinator = ShardCoordinator(engine, shard_run, *shard_slice) if shard_slice and shard_run and not output else None
+        if coordinator:
+            coordinator.start()
+        sink = ResultSink(output) if output else None
+        metrics = Metrics(metrics_path, metrics_format)
+        metrics.start(metrics_interval)
+        changed_maps = processor.qb_process_scores(
             engine,
             beatmap_path,
             map_modes=map_modes,
             score_modes=score_modes,
             score_statuses=score_status,
             map_statuses=map_status,
+            user_ids=user_ids,
+            map_ids=map_ids,
+            shard=shard_slice,
+            workers=workers,
+            executor=executor,
+            max_inflight_groups=max_inflight_groups or None,
+            max_inflight_scores=max_inflight_scores or None,
+            attr_cache=attr_cache,
+            write_mode=write_mode,
+            write_chunk_size=write_chunk_size,
+            writer_threads=writer_threads,
+            write_queue_size=write_queue_size,
+            write_flush_rows=write_flush_rows,
+            write_flush_seconds=write_flush_seconds,
+            pp_epsilon=pp_epsilon if pp_epsilon >= 0 else None,
+            checkpoint=checkpoint,
+            fetch_shards=fetch_shards,
+            fetch_mode=fetch_mode,
+            prefetch_workers=prefetch_workers,
+            split_scores=split_scores or None,
+            missing_maps_output=missing_maps_output,
+            metrics=metrics,
+            sink=sink,
+            index=index,
+            manifest=manifest if update_manifest else None,
         )
-        processor.qb_process_score_status(
-            engine,
-            map_modes=map_modes,
-            score_modes=score_modes,
-            score_statuses=score_status,
-        )
-        processor.qb_process_user_statistics(
-            engine,
-            redis_engine,
-            score_modes=score_modes,
-        )
+        if sink:
+            sink.close()
+            metrics.report()
+            metrics.close()
+            logging.info(f"Dry run completed, results are in {output}.")
+            return
+        if update_manifest:
+            if map_ids and not metrics.counters["errors"]:
+                # Changed maps without scores in scope were never read, they are hashed now so the next diff skips them.
+                manifest.record_all(index, map_ids)
+            manifest.save()
+        else:
+            logging.info(f"Filtered or sharded run, not updating the manifest at {manifest.path}.")
+        if coordinator:
+            if metrics.counters["errors"]:
+                logging.warning("Shard had errors, not reporting it done. Rerun it with --resume to finish the run.")
+                metrics.report()
+                metrics.close()
+                return
+            if not coordinator.finish():
+                metrics.report()
+                metrics.close()
+                return
+            # Status and stats are aggregated over every shard's maps, which this host does not know.
+            changed_maps = None
+            map_ids = None
+        if resume and (status_chunk == enums.StatusChunk.Maps or map_ids):
+            # Maps finished before the resume are not in changed_maps, fall back to the whole scope.
+            logging.warning("Resumed run, recomputing score status for every map in scope.")
+            changed_maps = set(map_ids) if map_ids else None
+        status_map_ids = changed_maps if status_chunk == enums.StatusChunk.Maps or map_ids else None
+        with metrics.timer("status"):
+            processor.qb_process_score_status(
+                engine,
+                map_modes=map_modes,
+                score_modes=score_modes,
+                score_statuses=score_status,
+                user_ids=user_ids,
+                map_ids=status_map_ids,
+                chunk=status_chunk,
+                chunk_size=status_chunk_size,
+                chunk_sleep=chunk_sleep,
+            )
+        with metrics.timer("user_statistics"):
+            if map_ids:
+                # Only the users with scores on the recalculated maps can have their pp moved.
+                stats_user_ids = processor.map_user_ids(engine, changed_maps or set(), score_modes=score_modes, user_ids=user_ids)
+                if stats_user_ids:
+                    processor.qb_process_user_statistics(
+                        engine,
+                        redis_engine,
+                        score_modes=score_modes,
+                        calc_pp=True,
+                        user_ids=stats_user_ids,
+                        chunk_size=stats_chunk_size or None,
+                        chunk_sleep=chunk_sleep,
+                    )
+                else:
+                    logging.info("No user had scores on the changed maps, skipping user statistics.")
+            else:
+                processor.qb_process_user_statistics(
+                    engine,
+                    redis_engine,
+                    score_modes=score_modes,
+                    calc_pp=True,
+                    user_ids=user_ids,
+                    chunk_size=stats_chunk_size or None,
+                    chunk_sleep=chunk_sleep,
+                )
+        metrics.report()
+        metrics.close()
         logging.info("Recalculation completed successfully")
     else:
         logging.error("Recalculation failed: Unable to connect to the database")
@@ -124,6 +405,50 @@ def reform(
             help="Score status (" + ", ".join(f"{status.name}: {status.value}" for status in enums.ScoreStatus) + ")",
         ),
     ] = None,
+    user_ids: Annotated[list[int] | None, typer.Option("--user-ids", "-u", help="Only recalculate these users")] = None,
+    stats_engine: Annotated[
+        enums.StatsEngine,
+        typer.Option(
+            "--stats-engine",
+            help="User pp engine. (" + ", ".join(f"{engine.name}: {engine.value}" for engine in enums.StatsEngine) + ")",
+        ),
+    ] = enums.StatsEngine.Sql.value,
+    status_chunk: Annotated[
+        enums.StatusChunk,
+        typer.Option(
+            "--status-chunk",
+            help="Recompute score status per batch of users or maps, off for one statement. ("
+            + ", ".join(f"{chunk.name}: {chunk.value}" for chunk in enums.StatusChunk)
+            + ")",
+        ),
+    ] = enums.StatusChunk.Off.value,
+    status_chunk_size: Annotated[int, typer.Option("--status-chunk-size", min=1, help="Users or maps per status chunk")] = 1000,
+    stats_chunk_size: Annotated[
+        int, typer.Option("--stats-chunk-size", min=0, help="Users per stats UPDATE chunk, 0 for one statement")
+    ] = 0,
+    chunk_sleep: Annotated[
+        float, typer.Option("--chunk-sleep", min=0, help="Seconds to sleep between status and stats chunks")
+    ] = 0,
+    write_mode: Annotated[
+        enums.WriteMode,
+        typer.Option(
+            "--write-mode",
+            help="How streamed user stats are written. (" + ", ".join(f"{mode.name}: {mode.value}" for mode in enums.WriteMode) + ")",
+        ),
+    ] = enums.WriteMode.Row.value,
+    metrics_path: Annotated[
+        str | None, typer.Option("--metrics-file", help="Write run metrics to this file, e.g. a node_exporter textfile .prom")
+    ] = None,
+    metrics_format: Annotated[
+        enums.MetricsFormat,
+        typer.Option(
+            "--metrics-format",
+            help="Metrics file format. (" + ", ".join(f"{fmt.name}: {fmt.value}" for fmt in enums.MetricsFormat) + ")",
+        ),
+    ] = enums.MetricsFormat.Prometheus.value,
+    metrics_interval: Annotated[
+        float, typer.Option("--metrics-interval", min=0, help="Seconds between metrics file snapshots, 0 to write only at the end")
+    ] = 15,
     log_level: str = typer.Option("INFO", "--log-level", "-l", help="Logging level"),
 ):
     # Set up logging
@@ -139,28 +464,226 @@ def reform(
     if statements.test_database_connection(mysql_uri):
         engine = create_engine(mysql_uri, isolation_level="AUTOCOMMIT")
         redis_engine = Redis.from_url(redis_uri, decode_responses=True)
+        metrics = Metrics(metrics_path, metrics_format)
+        metrics.start(metrics_interval)
         if enums.ReformTarget.ScoreStatus in table_names:
-            processor.qb_process_score_status(
-                engine,
-                map_modes=map_modes,
-                score_modes=score_modes,
-                score_statuses=score_status,
-                update_failed_scores=slow_level >= enums.ReformSlowLevel.Slowest,
-            )
+            with metrics.timer("status"):
+                processor.qb_process_score_status(
+                    engine,
+                    map_modes=map_modes,
+                    score_modes=score_modes,
+                    score_statuses=score_status,
+                    user_ids=user_ids,
+                    update_failed_scores=slow_level >= enums.ReformSlowLevel.Slowest,
+                    chunk=status_chunk,
+                    chunk_size=status_chunk_size,
+                    chunk_sleep=chunk_sleep,
+                )
         if enums.ReformTarget.UserStats in table_names:
-            processor.qb_process_user_statistics(
-                engine,
-                redis_engine,
-                score_modes=score_modes,
-                calc_pp=slow_level >= enums.ReformSlowLevel.Normal,
-                slow_statistics=slow_level >= enums.ReformSlowLevel.Slow,
-                very_slow_statistics=slow_level >= enums.ReformSlowLevel.Slower,
-            )
+            with metrics.timer("user_statistics"):
+                processor.qb_process_user_statistics(
+                    engine,
+                    redis_engine,
+                    score_modes=score_modes,
+                    calc_pp=slow_level >= enums.ReformSlowLevel.Normal,
+                    slow_statistics=slow_level >= enums.ReformSlowLevel.Slow,
+                    very_slow_statistics=slow_level >= enums.ReformSlowLevel.Slower,
+                    user_ids=user_ids,
+                    stats_engine=stats_engine,
+                    write_mode=write_mode,
+                    chunk_size=stats_chunk_size or None,
+                    chunk_sleep=chunk_sleep,
+                )
+        metrics.report()
+        metrics.close()
         logging.info("Recalculation completed successfully")
     else:
         logging.error("Recalculation failed: Unable to connect to the database")
 
 
+@app.command(help="Write the pp values of a recalc --output file to the database and recompute the affected score status")
+def apply(
+    results_path: Annotated[str, typer.Argument(help="Results file written by recalc --output")],
+    mysql_uri: Annotated[str, typer.Option("--mysql-uri", "-m", help="Database URI to connect to")] = "mysql+pymysql://localhost:3306",
+    write_mode: Annotated[
+        enums.WriteMode,
+        typer.Option(
+            "--write-mode",
+            help="How pp values are written. (" + ", ".join(f"{mode.name}: {mode.value}" for mode in enums.WriteMode) + ")",
+        ),
+    ] = enums.WriteMode.Bulk.value,
+    write_chunk_size: Annotated[int, typer.Option("--write-chunk-size", min=1, help="Rows per write")] = 10000,
+    status: Annotated[bool, typer.Option("--status/--no-status", help="Recompute score status of the affected maps")] = True,
+    status_chunk_size: Annotated[int, typer.Option("--status-chunk-size", min=1, help="Maps per status chunk")] = 1000,
+    chunk_sleep: Annotated[float, typer.Option("--chunk-sleep", min=0, help="Seconds to sleep between chunks")] = 0,
+    log_level: str = typer.Option("INFO", "--log-level", "-l", help="Logging level"),
+):
+    # Set up logging
+    numeric_level = getattr(logging, log_level.upper(), None)
+    if not isinstance(numeric_level, int):
+        raise ValueError(f"Invalid log level: {log_level}")
+    logging.basicConfig(level=numeric_level, format="%(asctime)s - %(levelname)s - %(message)s")
+    coloredlogs.install(level="DEBUG")
+
+    if statements.test_database_connection(mysql_uri):
+        engine = create_engine(mysql_uri, isolation_level="AUTOCOMMIT")
+        map_ids = processor.apply_results(engine, results_path, write_mode, write_chunk_size, chunk_sleep)
+        if status:
+            processor.qb_process_score_status(
+                engine,
+                map_ids=map_ids,
+                chunk=enums.StatusChunk.Maps,
+                chunk_size=status_chunk_size,
+                chunk_sleep=chunk_sleep,
+            )
+        logging.info("Apply completed successfully, run reform -t stats to refresh user statistics")
+    else:
+        logging.error("Apply failed: Unable to connect to the database")
+
+
+@app.command(help="Keep recalculating newly submitted scores and the affected statistics until interrupted")
+def watch(
+    mysql_uri: Annotated[str, typer.Option("--mysql-uri", "-m", help="Database URI to connect to")] = "mysql+pymysql://localhost:3306",
+    redis_uri: Annotated[str, typer.Option("--redis-uri", "-r", help="Redis URI to connect to")] = "redis://localhost:6379",
+    beatmap_path: str = typer.Option(..., "--beatmap-path", "-b", help="Path to the beatmaps directory"),
+    score_modes: Annotated[
+        list[enums.BanchoPyMode] | None,
+        typer.Option(
+            "--score-modes",
+            "-sm",
+            help="Score modes. (" + ", ".join(f"{mode.name}: {mode.value}" for mode in enums.BanchoPyMode) + ")",
+        ),
+    ] = None,
+    interval: Annotated[float, typer.Option("--interval", min=0.1, help="Seconds between polls once caught up")] = 5,
+    batch_size: Annotated[int, typer.Option("--batch-size", min=1, help="Max score ids covered per batch")] = 5000,
+    lookback: Annotated[
+        int, typer.Option("--lookback", min=0, help="Score ids below the watermark scanned again for late committed scores")
+    ] = 1000,
+    from_id: Annotated[
+        int | None, typer.Option("--from-id", help="Start after this score id instead of the saved watermark or the newest score")
+    ] = None,
+    state_path: Annotated[
+        str | None,
+        typer.Option("--state", help="Watermark file, defaults to nyamatrix_watch.json next to the beatmaps directory"),
+    ] = None,
+    workers: Annotated[int, typer.Option("--workers", "-w", min=1, help="Number of pp calculation threads")] = 4,
+    attr_cache_path: Annotated[
+        str | None,
+        typer.Option(
+            "--attr-cache",
+            help="Cache file of final pp and star ratings per score state (not difficulty attributes), "
+            "defaults to nyamatrix_cache.db next to the beatmaps directory",
+        ),
+    ] = None,
+    attr_cache_size: Annotated[
+        int, typer.Option("--attr-cache-size", min=0, help="Max attribute cache entries, 0 to disable the cache")
+    ] = 10_000_000,
+    cached_maps: Annotated[int, typer.Option("--cached-maps", min=1, help="Recently used .osu files kept in memory")] = 2000,
+    pp_epsilon: Annotated[
+        float, typer.Option("--pp-epsilon", help="Only write scores whose pp moved by more than this, negative to write every score")
+    ] = 0.001,
+    metrics_path: Annotated[
+        str | None, typer.Option("--metrics-file", help="Write watch metrics to this file after every batch")
+    ] = None,
+    metrics_format: Annotated[
+        enums.MetricsFormat,
+        typer.Option(
+            "--metrics-format",
+            help="Metrics file format. (" + ", ".join(f"{fmt.name}: {fmt.value}" for fmt in enums.MetricsFormat) + ")",
+        ),
+    ] = enums.MetricsFormat.Prometheus.value,
+    log_level: str = typer.Option("INFO", "--log-level", "-l", help="Logging level"),
+):
+    # Set up logging
+    numeric_level = getattr(logging, log_level.upper(), None)
+    if not isinstance(numeric_level, int):
+        raise ValueError(f"Invalid log level: {log_level}")
+    logging.basicConfig(level=numeric_level, format="%(asctime)s - %(levelname)s - %(message)s")
+    coloredlogs.install(level="DEBUG")
+
+    if statements.test_database_connection(mysql_uri):
+        engine = create_engine(mysql_uri, isolation_level="AUTOCOMMIT")
+        redis_engine = Redis.from_url(redis_uri, decode_responses=True)
+        attr_cache = (
+            AttributeCache(attr_cache_path or Path(beatmap_path).resolve().parent / "nyamatrix_cache.db", attr_cache_size)
+            if attr_cache_size
+            else None
+        )
+        watcher = Watcher(
+            engine,
+            redis_engine,
+            beatmap_path,
+            state_path or Path(beatmap_path).resolve().parent / "nyamatrix_watch.json",
+            score_modes=score_modes,
+            attr_cache=attr_cache,
+            batch_size=batch_size,
+            lookback=lookback,
+            workers=workers,
+            pp_epsilon=pp_epsilon if pp_epsilon >= 0 else None,
+            cached_maps=cached_maps,
+            metrics=Metrics(metrics_path, metrics_format),
+        )
+        watcher.load_watermark(from_id)
+        watcher.run(interval)
+    else:
+        logging.error("Watch failed: Unable to connect to the database")
+
+
+@app.command(help="Benchmark recalc stages on a synthetic dataset and print the results as JSON")
+def bench(
+    beatmap_path: Annotated[
+        str, typer.Option("--beatmap-path", "-b", help="Directory the synthetic .osu files are written to")
+    ] = "nyamatrix_bench_maps",
+    mysql_uri: Annotated[
+        str | None,
+        typer.Option("--mysql-uri", "-m", help="Throwaway database to load the dataset into, omit to use the in-memory writer"),
+    ] = None,
+    reset: Annotated[bool, typer.Option("--reset", help="Clear the benchmark database if it already has scores")] = False,
+    maps: Annotated[int, typer.Option("--maps", min=1, help="Number of synthetic maps")] = 2000,
+    scores: Annotated[int, typer.Option("--scores", min=1, help="Approximate number of synthetic scores")] = 1_000_000,
+    users: Annotated[int, typer.Option("--users", min=1, help="Number of synthetic users")] = 20000,
+    skew: Annotated[float, typer.Option("--skew", min=0, help="Zipf exponent of the scores per map distribution")] = 1.1,
+    seed: Annotated[int, typer.Option("--seed", help="Dataset seed")] = 1,
+    workers: Annotated[int, typer.Option("--workers", "-w", min=1, help="Number of pp calculation workers")] = 4,
+    executor: Annotated[
+        enums.ExecutorKind,
+        typer.Option(
+            "--executor",
+            "-e",
+            help="Worker pool kind. (" + ", ".join(f"{kind.name}: {kind.value}" for kind in enums.ExecutorKind) + ")",
+        ),
+    ] = enums.ExecutorKind.Thread.value,
+    output: Annotated[str | None, typer.Option("--output", "-o", help="Write the JSON results to this file")] = None,
+    log_level: str = typer.Option("INFO", "--log-level", "-l", help="Logging level"),
+):
+    # Set up logging
+    numeric_level = getattr(logging, log_level.upper(), None)
+    if not isinstance(numeric_level, int):
+        raise ValueError(f"Invalid log level: {log_level}")
+    logging.basicConfig(level=numeric_level, format="%(asctime)s - %(levelname)s - %(message)s")
+    coloredlogs.install(level="DEBUG")
+
+    engine = None
+    if mysql_uri:
+        if not statements.test_database_connection(mysql_uri):
+            logging.error("Benchmark failed: Unable to connect to the database")
+            return
+        engine = create_engine(mysql_uri, isolation_level="AUTOCOMMIT")
+    result = benchmark.run(
+        beatmap_path=Path(beatmap_path),
+        maps=maps,
+        scores=scores,
+        users=users,
+        skew=skew,
+        seed=seed,
+        workers=workers,
+        executor=executor,
+        engine=engine,
+        reset=reset,
+    )
+    benchmark.write_result(result, output)
+
+
 def main():
     app()
 
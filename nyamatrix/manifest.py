@@ -0,0 +1,80 @@
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Iterable
+
+from nyamatrix.beatmaps import BeatmapIndex
+
+
+class Manifest:
+    """
+    The content hash of every .osu file as of the last recalc that read it, kept to find the maps changed since.
+    One "<map id> <size> <mtime> <md5>" line per map. Files whose size and mtime still match are taken as unchanged,
+    only the others are read and hashed, so a diff costs a directory scan plus the changed files.
+    """
+
+    def __init__(self, path: str | Path):
+        self.path = Path(path)
+        self.entries: dict[int, tuple[int, float, str]] = {}
+        self._lock = threading.Lock()
+        if self.path.exists():
+            with self.path.open() as f:
+                for line in f:
+                    map_id, size, mtime, md5 = line.split()
+                    self.entries[int(map_id)] = (int(size), float(mtime), md5)
+            logging.info(f"Loaded manifest of {len(self.entries)} beatmaps from {self.path}.")
+
+    def diff(self, index: BeatmapIndex) -> set[int]:
+        """
+        The ids of the maps that are new or whose content changed since they were recorded.
+        Maps that were only touched get their new size and mtime recorded, so they are not hashed again.
+        """
+        started = time.perf_counter()
+        changed: set[int] = set()
+        hashed = 0
+        for map_id, (size, mtime) in index.entries.items():
+            entry = self.entries.get(map_id)
+            if entry is None:
+                changed.add(map_id)
+                continue
+            if entry[0] == size and entry[1] == mtime:
+                continue
+            _, beatmap_hash = index.read(map_id)
+            hashed += 1
+            if beatmap_hash == entry[2]:
+                self.record(map_id, size, mtime, beatmap_hash)
+            else:
+                changed.add(map_id)
+        logging.info(
+            f"{len(changed)} of {len(index)} beatmaps are new or changed, {hashed} hashed ({time.perf_counter() - started:.1f}s)."
+        )
+        return changed
+
+    def record(self, map_id: int, size: int, mtime: float, beatmap_hash: str) -> None:
+        with self._lock:
+            self.entries[map_id] = (size, mtime, beatmap_hash)
+
+    def record_read(self, index: BeatmapIndex, map_id: int) -> None:
+        """
+        Record a map as read from the index, with the hash taken when it was read.
+        """
+        self.record(map_id, *index.entries[map_id], index.hashes[map_id])
+
+    def record_all(self, index: BeatmapIndex, map_ids: Iterable[int]) -> None:
+        """
+        Record maps whether the run read them or not (no scores in scope), hashing the unread ones now.
+        """
+        for map_id in map_ids:
+            if map_id not in index.hashes:
+                index.read(map_id)
+            self.record_read(index, map_id)
+
+    def save(self) -> None:
+        with self._lock:
+            lines = [f"{map_id} {size} {mtime!r} {md5}\n" for map_id, (size, mtime, md5) in sorted(self.entries.items())]
+        partial = self.path.with_name(self.path.name + ".tmp")
+        partial.write_text("".join(lines))
+        os.replace(partial, self.path)
+        logging.info(f"Saved manifest of {len(lines)} beatmaps to {self.path}.")
@@ -0,0 +1,170 @@
+import bisect
+import heapq
+import json
+import logging
+import os
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Iterator, Optional
+
+from nyamatrix import enums
+
+# Upper bounds in seconds of the per map duration histograms.
+BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0)
+# Per map stage seconds reported by _process_map that get a histogram.
+MAP_STAGES = ("parse", "convert", "calc", "cache", "write", "map")
+SLOWEST_MAPS = 20
+
+
+class Histogram:
+    def __init__(self, buckets: tuple[float, ...] = BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    def cumulative(self) -> list[tuple[str, int]]:
+        total = 0
+        result = []
+        for bound, count in zip([*map(str, self.buckets), "+Inf"], self.counts):
+            total += count
+            result.append((bound, total))
+        return result
+
+
+class Metrics:
+    """
+    Counters, per map stage duration histograms and the slowest maps of a run, shared by the pipeline threads.
+    Counters ending in _seconds are stage totals (summed over workers, so they can exceed the wall time).
+    A snapshot is written as a Prometheus textfile or as JSON, periodically when started with an interval.
+    """
+
+    def __init__(self, path: Optional[str | Path] = None, format: enums.MetricsFormat = enums.MetricsFormat.Prometheus):
+        self.path = Path(path) if path else None
+        self.format = format
+        self.counters: Counter = Counter()
+        self.histograms = {stage: Histogram() for stage in MAP_STAGES}
+        self.slowest: list[tuple[float, int, int]] = []
+        self.started = time.time()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def update(self, stats: Counter) -> None:
+        with self._lock:
+            self.counters.update(stats)
+
+    def inc(self, name: str, value: float = 1) -> None:
+        with self._lock:
+            self.counters[name] += value
+
+    def observe_map(self, map_id: int, stats: Counter) -> None:
+        """
+        Add the stats of one processed map, see _process_map.
+        """
+        with self._lock:
+            self.counters.update(stats)
+            for stage in MAP_STAGES:
+                self.histograms[stage].observe(stats[f"{stage}_seconds"])
+            entry = (stats["map_seconds"], map_id, stats["scores"])
+            if len(self.slowest) < SLOWEST_MAPS:
+                heapq.heappush(self.slowest, entry)
+            else:
+                heapq.heappushpop(self.slowest, entry)
+
+    @contextmanager
+    def timer(self, stage: str) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.inc(f"{stage}_seconds", time.perf_counter() - started)
+
+    def slowest_maps(self) -> list[tuple[float, int, int]]:
+        with self._lock:
+            return sorted(self.slowest, reverse=True)
+
+    def snapshot(self) -> dict[str, Any]:
+        with self._lock:
+            return {
+                "started": self.started,
+                "elapsed_seconds": round(time.time() - self.started, 3),
+                "counters": dict(self.counters),
+                "histograms": {
+                    stage: {"buckets": dict(histogram.cumulative()), "sum": histogram.sum}
+                    for stage, histogram in self.histograms.items()
+                },
+                "slowest_maps": [
+                    {"map_id": map_id, "seconds": seconds, "scores": scores}
+                    for seconds, map_id, scores in sorted(self.slowest, reverse=True)
+                ],
+            }
+
+    def prometheus(self) -> str:
+        with self._lock:
+            lines = []
+            stages = {name[: -len("_seconds")]: value for name, value in self.counters.items() if name.endswith("_seconds")}
+            lines.append("# TYPE nyamatrix_stage_seconds_total counter")
+            lines.extend(f'nyamatrix_stage_seconds_total{{stage="{stage}"}} {value}' for stage, value in sorted(stages.items()))
+            for name, value in sorted(self.counters.items()):
+                if not name.endswith("_seconds"):
+                    lines.append(f"# TYPE nyamatrix_{name}_total counter")
+                    lines.append(f"nyamatrix_{name}_total {value}")
+            lines.append("# TYPE nyamatrix_map_stage_seconds histogram")
+            for stage, histogram in self.histograms.items():
+                for bound, count in histogram.cumulative():
+                    lines.append(f'nyamatrix_map_stage_seconds_bucket{{stage="{stage}",le="{bound}"}} {count}')
+                lines.append(f'nyamatrix_map_stage_seconds_sum{{stage="{stage}"}} {histogram.sum}')
+                lines.append(f'nyamatrix_map_stage_seconds_count{{stage="{stage}"}} {sum(histogram.counts)}')
+            lines.append("# TYPE nyamatrix_last_update_timestamp_seconds gauge")
+            lines.append(f"nyamatrix_last_update_timestamp_seconds {time.time()}")
+            return "\n".join(lines) + "\n"
+
+    def write(self) -> None:
+        if not self.path:
+            return
+        payload = self.prometheus() if self.format == enums.MetricsFormat.Prometheus else json.dumps(self.snapshot(), indent=2)
+        # Written aside and renamed, so a textfile collector never reads half a file.
+        partial = self.path.with_name(self.path.name + ".tmp")
+        partial.write_text(payload)
+        os.replace(partial, self.path)
+
+    def start(self, interval: float) -> None:
+        if not self.path or interval <= 0:
+            return
+
+        def loop() -> None:
+            while not self._stop.wait(interval):
+                try:
+                    self.write()
+                except OSError as e:
+                    logging.warning(f"Failed to write metrics to {self.path}: {e}")
+
+        self._thread = threading.Thread(target=loop, name="nyamatrix-metrics", daemon=True)
+        self._thread.start()
+
+    def close(self) -> None:
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+        self.write()
+
+    def report(self) -> None:
+        """
+        Log the stage totals and the slowest maps.
+        """
+        stages = ", ".join(
+            f"{name[: -len('_seconds')]} {value:.1f}s" for name, value in sorted(self.counters.items()) if name.endswith("_seconds")
+        )
+        logging.info(f"Stage seconds: {stages}.")
+        slowest = self.slowest_maps()
+        if slowest:
+            logging.info(f"Top {len(slowest)} slowest maps:")
+            for seconds, map_id, scores in slowest:
+                logging.info(f"  map {map_id}: {seconds:.2f}s for {scores} scores")
@@ -0,0 +1,49 @@
+from nyamatrix.enums import Mods
+
+KEY_MODS = (
+    Mods.Key1 | Mods.Key2 | Mods.Key3 | Mods.Key4 | Mods.Key5 | Mods.Key6 | Mods.Key7 | Mods.Key8 | Mods.Key9 | Mods.KeyCoop
+)
+# Mods that never change the difficulty attributes of a stable (lazer=False) calculation in any mode.
+# They still count for pp, the performance step always gets the score's own mods.
+PERFORMANCE_ONLY = (
+    Mods.NoFail
+    | Mods.SuddenDeath
+    | Mods.Perfect
+    | Mods.SpunOut
+    | Mods.FadeIn
+    | Mods.Random
+    | Mods.ScoreV2
+    | Mods.Mirror
+)
+# Per rosu-pp mode (0 osu, 1 taiko, 2 catch, 3 mania), on top of PERFORMANCE_ONLY.
+# Key mods only pick the key count of mania converts.
+MODE_PERFORMANCE_ONLY: dict[int, Mods] = {
+    0: KEY_MODS,
+    1: Mods.TouchDevice | Mods.Hidden | Mods.Flashlight | Mods.Autopilot | KEY_MODS,
+    2: Mods.TouchDevice | Mods.Hidden | Mods.Relax | Mods.Flashlight | Mods.Autopilot | KEY_MODS,
+    3: Mods.Easy | Mods.TouchDevice | Mods.Hidden | Mods.HardRock | Mods.Relax | Mods.Flashlight | Mods.Autopilot,
+}
+
+
+def canonical_mods(mods: int, mode: int) -> int:
+    """
+    The difficulty relevant part of a mods value for a rosu-pp mode: scores whose canonical mods match
+    share their difficulty attributes. Nightcore is only dropped next to DoubleTime: a stable calculation
+    does not speed up a score with the Nightcore bit alone, so those keep their own attributes.
+    """
+    mods = int(mods)
+    if mods & Mods.Nightcore and mods & Mods.DoubleTime:
+        mods &= ~int(Mods.Nightcore)
+    return mods & ~int(PERFORMANCE_ONLY | MODE_PERFORMANCE_ONLY[mode])
+
+
+if __name__ == "__main__":
+    for mods in (
+        0,
+        Mods.NoFail | Mods.Hidden,
+        Mods.Nightcore,
+        Mods.DoubleTime | Mods.Nightcore,
+        Mods.HardRock | Mods.Perfect | Mods.SuddenDeath,
+    ):
+        print(Mods(mods), [Mods(canonical_mods(mods, mode)) for mode in range(4)])
+    assert all(canonical_mods(Mods.Nightcore, mode) != canonical_mods(Mods.DoubleTime, mode) for mode in range(4))
@@ -0,0 +1,205 @@
+import logging
+import queue
+import threading
+import time
+from collections import Counter
+from typing import Callable, Optional
+from sqlalchemy import Connection, Engine
+
+
+class InflightLimiter:
+    """
+    Bounds how much work has been handed to the worker pool but not finished yet.
+    acquire() blocks the reader once either high-water mark is reached, release() is called when a task is done.
+    A single task larger than max_scores is still admitted once nothing else is in flight, so it can not deadlock.
+    """
+
+    def __init__(self, max_groups: Optional[int] = None, max_scores: Optional[int] = None):
+        self.max_groups = max_groups
+        self.max_scores = max_scores
+        self.groups = 0
+        self.scores = 0
+        self._cond = threading.Condition()
+
+    def _full(self, scores: int) -> bool:
+        if self.groups == 0:
+            return False
+        if self.max_groups and self.groups >= self.max_groups:
+            return True
+        if self.max_scores and self.scores + scores > self.max_scores:
+            return True
+        return False
+
+    def acquire(self, scores: int) -> None:
+        with self._cond:
+            while self._full(scores):
+                self._cond.wait()
+            self.groups += 1
+            self.scores += scores
+
+    def release(self, scores: int) -> None:
+        with self._cond:
+            self.groups -= 1
+            self.scores -= scores
+            self._cond.notify_all()
+
+
+class WriterStage:
+    """
+    Dedicated writer threads between the compute workers and the database, fed through a queue of row lists.
+    submit never blocks, it is called from future callbacks (on the pool's management thread for process workers),
+    the producers call wait_for_room before taking on more work instead, while queue_size lists are waiting.
+    Each thread coalesces the queued lists into one write until flush_rows rows are buffered
+    or flush_seconds have passed since the first one, so thousands of small maps share a transaction.
+    The engine runs in autocommit, so the writer connections switch to READ COMMITTED and wrap every write
+    in an explicit transaction, write must not commit itself. commits counts the transactions committed,
+    one per flush unless a failed flush was retried list by list.
+    A failed flush is retried list by list on a fresh connection, so only the lists that fail on their own are lost.
+    Every thread keeps its connection between flushes, a slow commit holds up a writer instead of a compute slot.
+    on_done(error, seconds) is called from the writer thread once a list is written, error is None on success.
+    """
+
+    def __init__(
+        self,
+        engine: Engine,
+        write: Callable[[Connection, list], None],
+        threads: int = 2,
+        queue_size: int = 64,
+        flush_rows: int = 5000,
+        flush_seconds: float = 1.0,
+    ):
+        self.engine = engine
+        self.write = write
+        self.queue_size = queue_size
+        self.flush_rows = flush_rows
+        self.flush_seconds = flush_seconds
+        self.queue_wait_seconds = 0.0
+        self.flushes = 0
+        self.commits = 0
+        self.retries = 0
+        self._queue: queue.Queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._room = threading.Condition()
+        self._threads = [threading.Thread(target=self._run, name=f"nyamatrix-writer-{i}", daemon=True) for i in range(threads)]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, rows: list, on_done: Callable[[Optional[BaseException], float], None]) -> None:
+        self._queue.put((rows, on_done))
+
+    def wait_for_room(self) -> None:
+        """
+        Block while queue_size lists are waiting for a writer thread.
+        """
+        started = time.perf_counter()
+        with self._room:
+            self._room.wait_for(lambda: self._queue.qsize() < self.queue_size)
+        with self._lock:
+            self.queue_wait_seconds += time.perf_counter() - started
+
+    def _take(self, timeout: Optional[float] = None):
+        item = self._queue.get(timeout=timeout)
+        with self._room:
+            self._room.notify_all()
+        return item
+
+    def _collect(self) -> tuple[list[tuple[list, Callable]], bool]:
+        """
+        Block for the next list, then keep taking lists until the flush thresholds, returns them and whether to stop.
+        """
+        if (item := self._take()) is None:
+            return [], True
+        items = [item]
+        buffered = len(item[0])
+        deadline = time.perf_counter() + self.flush_seconds
+        while buffered < self.flush_rows:
+            try:
+                item = self._take(max(0.0, deadline - time.perf_counter()))
+            except queue.Empty:
+                break
+            if item is None:
+                return items, True
+            items.append(item)
+            buffered += len(item[0])
+        return items, False
+
+    def _connect(self) -> Connection:
+        return self.engine.connect().execution_options(isolation_level="READ COMMITTED")
+
+    def _flush(self, conn: Connection | None, items: list[tuple[list, Callable]], retry: bool = False) -> Connection | None:
+        started = time.perf_counter()
+        if not retry:
+            with self._lock:
+                self.flushes += 1
+        try:
+            conn = conn or self._connect()
+            with conn.begin():
+                self.write(conn, [row for rows, _ in items for row in rows])
+        except Exception as e:
+            if conn is not None:
+                conn.close()
+            if len(items) == 1:
+                self._done(items[0][1], e, time.perf_counter() - started)
+                return None
+            logging.warning(f"Write of {len(items)} coalesced batches failed, retrying them one by one: {e}")
+            with self._lock:
+                self.retries += 1
+            conn = None
+            for item in items:
+                conn = self._flush(conn, [item], retry=True)
+            return conn
+        with self._lock:
+            self.commits += 1
+        seconds = time.perf_counter() - started
+        total = sum(len(rows) for rows, _ in items) or 1
+        for rows, on_done in items:
+            self._done(on_done, None, seconds * len(rows) / total)
+        return conn
+
+    @staticmethod
+    def _done(on_done: Callable, error: Optional[BaseException], seconds: float) -> None:
+        try:
+            on_done(error, seconds)
+        except Exception as e:
+            logging.error(f"Writer callback failed: {e}")
+
+    def _run(self) -> None:
+        conn: Connection | None = None
+        stop = False
+        while not stop:
+            items, stop = self._collect()
+            if items:
+                conn = self._flush(conn, items)
+        if conn is not None:
+            conn.close()
+
+    def close(self) -> None:
+        """
+        Flush everything queued so far, then stop the threads.
+        """
+        for _ in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+
+
+class MapParts:
+    """
+    Completion of a map whose groups were split into parts (see split_groups): the parts' stats are summed
+    and done() hands them back once the last part is finished, so the map is checkpointed only as a whole.
+    """
+
+    def __init__(self, parts: int, groups: int):
+        self.remaining = parts
+        self.groups = groups
+        self.stats: Counter = Counter()
+        self._lock = threading.Lock()
+
+    def done(self, stats: Counter) -> Optional[Counter]:
+        with self._lock:
+            self.stats.update(stats)
+            self.remaining -= 1
+            if self.remaining:
+                return None
+        self.stats["groups"] = self.groups
+        return self.stats
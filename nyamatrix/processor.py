@@ -1,21 +1,50 @@
-import json
 import logging
 import math
-from typing import Optional
+import multiprocessing
+import threading
+import time
+from collections import Counter, deque
+from typing import Callable, Iterable, Optional
 from tqdm import tqdm
 from pathlib import Path
 from redis import Redis
-from sqlalchemy import Engine, text
+from sqlalchemy import Engine, create_engine, text
 from rosu_pp_py import Beatmap, GameMode, Performance, PerformanceAttributes
-from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor
 
 from nyamatrix import enums
 from nyamatrix import statements
-from nyamatrix.qb.group_scores import query as qb_group_scores, count as qb_count_scores
+from nyamatrix.attr_cache import AttributeCache, ScoreState
+from nyamatrix.beatmaps import BeatmapIndex, report_missing
+from nyamatrix.checkpoint import Checkpoint
+from nyamatrix.chunked import id_ranges, run_chunked
+from nyamatrix.leaderboard import LeaderboardWriter
+from nyamatrix.manifest import Manifest
+from nyamatrix.metrics import Metrics
+from nyamatrix.mods import canonical_mods
+from nyamatrix.pipeline import InflightLimiter, MapParts, WriterStage
+from nyamatrix.scores import Score, ScoreGroups, iter_json_groups, iter_row_groups, split_groups
+from nyamatrix.sinks import ResultRow, ResultSink, iter_results
+from nyamatrix.user_stats import iter_user_stats
+from nyamatrix.writer import write_scores_pp, write_user_stats
+from nyamatrix.qb.group_scores import (
+    query as qb_group_scores,
+    count as qb_count_scores,
+    rows as qb_score_rows,
+    sizes as qb_score_sizes,
+)
+from nyamatrix.qb.map_users import query as qb_map_users
 from nyamatrix.qb.update_score_status import query as qb_update_score_status
 from nyamatrix.qb.update_user_statistics_use_status import query as qb_update_user_statistics
+from nyamatrix.qb.user_best_scores import query as qb_user_best_scores, keys as qb_user_stats_keys
 
-STATEMENT_UPDATE_SCORES = "UPDATE scores SET pp = :pp WHERE id = :id"
+# Checkpoint streams of the maps read apart for being split, and of the maps a resumed run retries
+# for their .osu file having been missing, see qb_process_scores.
+LARGE_STREAM = -1
+MISSING_STREAM = -2
+
+STATEMENT_MAP_ID_BOUNDS = "SELECT MIN(id), MAX(id) FROM maps"
+STATEMENT_FETCH_MAP_IDS = "SELECT id FROM maps ORDER BY id"
 STATEMENT_COUNT_USER_STATISTICS = "SELECT COUNT(*) FROM stats s INNER JOIN users u ON s.id = u.id WHERE s.mode IN :modes"
 STATEMENT_FETCH_USER_STATISTICS = "SELECT s.id, s.mode, s.pp, u.country, u.priv FROM stats s INNER JOIN users u ON s.id = u.id WHERE s.mode IN :modes"
 
@@ -27,6 +56,26 @@ gm_dict: dict[int, GameMode] = {
     3: GameMode.Mania,
 }
 
+# Engine owned by a process pool worker, see _init_process_worker.
+_worker_engine: Engine | None = None
+
+
+def _init_process_worker(mysql_uri: str, log_level: int) -> None:
+    global _worker_engine
+    logging.basicConfig(level=log_level, format="%(asctime)s - %(levelname)s - %(message)s")
+    _worker_engine = create_engine(mysql_uri, isolation_level="AUTOCOMMIT")
+
+
+def _create_executor(engine: Engine, executor: enums.ExecutorKind, workers: int) -> Executor:
+    if executor == enums.ExecutorKind.Process:
+        return ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_process_worker,
+            initargs=(engine.url.render_as_string(hide_password=False), logging.getLogger().getEffectiveLevel()),
+        )
+    return ThreadPoolExecutor(max_workers=workers)
+
 
 def _process_score(
     attr_or_map: Beatmap | PerformanceAttributes, array: tuple[int, int, int, int, int, int, int, int]
@@ -52,39 +101,171 @@ def _process_score(
 
 
 def _process_group(
-    map_id: int,
     mode: int,
-    scores: list[tuple[int, int, int, int, int, int, int, int, int]],
-    map_path: str,
-    tqdm: tqdm,
-    engine: Engine,
-):
+    scores: Iterable[Score],
+    load_beatmap: Callable[[int], Beatmap],
+    cached: dict[ScoreState, tuple[float, float]],
+    stats: Counter,
+    pp_epsilon: float | None = None,
+) -> tuple[list[tuple[int, float, float | None, float]], dict[ScoreState, tuple[float, float]]]:
+    """
+    Calculate one (map, mode) group, returns (score id, pp, stored pp, stars) for the scores to write and new cache entries.
+    The new entries double as the group's memo, every distinct score state is calculated once.
+    """
+    results_list: list[tuple[int, float, float | None, float]] = []
+    # Difficulty attributes by canonical mods, see canonical_mods, and the raw mods they were looked up with.
+    attr_buffer: dict[int, PerformanceAttributes] = {}
+    seen_mods: set[int] = set()
+    new_entries: dict[ScoreState, tuple[float, float]] = {}
+
+    for score in scores:
+        state: ScoreState = tuple(score[1:9])  # type: ignore
+        if (hit := cached.get(state)) is not None:
+            stats["attr_cache_hits"] += 1
+            pp_value, stars = hit
+        elif (hit := new_entries.get(state)) is not None:
+            # Identical (mods, combo, hit counts) earlier in the group, e.g. the SS plays of a farm map.
+            stats["score_memo_hits"] += 1
+            pp_value, stars = hit
+        else:
+            stats["attr_cache_misses"] += 1
+            mods_key = canonical_mods(score[1], mode % 4)
+            if (attr_or_map := attr_buffer.get(mods_key)) is not None:
+                stats["difficulty_reuses"] += 1
+                if score[1] not in seen_mods:
+                    stats["difficulty_canonical_reuses"] += 1
+            else:
+                attr_or_map = load_beatmap(mode % 4)
+            seen_mods.add(score[1])
+            if not (result_attr := _process_score(attr_or_map, state)):
+                continue
+            if isinstance(attr_or_map, Beatmap):
+                stats["difficulty_calcs"] += 1
+                attr_buffer[mods_key] = result_attr
+            pp_value = result_attr.pp
+            if math.isnan(pp_value) or math.isinf(pp_value) or pp_value > 9999:
+                pp_value = 0.0
+            stars = result_attr.difficulty.stars
+            new_entries[state] = (pp_value, stars)
+        old_pp = score[9]
+        if pp_epsilon is not None and old_pp is not None and abs(pp_value - old_pp) <= pp_epsilon:
+            stats["unchanged"] += 1
+            continue
+        stats["changed"] += 1
+        results_list.append((score[0], pp_value, old_pp, stars))
+    return results_list, new_entries
+
+
+def _parse_beatmap(content: bytes, gm: int, stats: Counter) -> Beatmap:
+    # rosu-pp-py can not convert a map twice, every target mode gets its own parse of the same bytes.
+    parse_started = time.perf_counter()
+    beatmap = Beatmap(bytes=content)
+    convert_started = time.perf_counter()
+    beatmap.convert(gm_dict[gm], None)
+    stats["beatmap_parses"] += 1
+    stats["parse_seconds"] += convert_started - parse_started
+    stats["convert_seconds"] += time.perf_counter() - convert_started
+    return beatmap
+
+
+def _process_map(
+    map_id: int,
+    groups: ScoreGroups,
+    content: bytes,
+    beatmap_hash: str,
+    engine: Engine | None = None,
+    attr_cache: AttributeCache | None = None,
+    write_mode: enums.WriteMode = enums.WriteMode.Row,
+    write_chunk_size: int = 10000,
+    pp_epsilon: float | None = None,
+    return_rows: bool = False,
+    parsed: dict[int, Beatmap] | None = None,
+) -> tuple[Counter, list[ResultRow] | None]:
+    """
+    Process every score mode played on one map from its prefetched .osu content, parsed once per converted mode
+    (or taken from parsed, the converted beatmaps shared by the parts of a split map).
+    The returned stats carry the seconds spent parsing, converting, calculating, in the attribute cache and writing.
+    With return_rows nothing is written, the result rows are returned for a ResultSink or the WriterStage instead.
+    """
+    engine = engine or _worker_engine
+    assert engine is not None or return_rows, "no database engine available in this worker"
+    rows: list[ResultRow] | None = [] if return_rows else None
+    started = time.perf_counter()
+    stats = Counter(scores=sum(len(scores) for scores in groups.values()), groups=len(groups))
     try:
-        scores_num = len(scores)
-        beatmap_path = Path(map_path) / f"{map_id}.osu"
-        if beatmap_path.exists():
-            beatmap = Beatmap(path=str(beatmap_path))
-            beatmap.convert(gm_dict[mode % 4], None)
-
-            results_list: list[tuple[int, float]] = [None] * scores_num  # type: ignore
-            attr_buffer: dict[int, PerformanceAttributes] = {}
-
-            for i, score in enumerate(scores):
-                attr_or_map = attr_buffer.get(score[1], beatmap)
-                if result_attr := _process_score(attr_or_map, score[1:]):
-                    if isinstance(attr_or_map, Beatmap):
-                        attr_buffer[score[1]] = result_attr
-                    pp_value = result_attr.pp
-                    if math.isnan(pp_value) or math.isinf(pp_value) or pp_value > 9999:
-                        pp_value = 0.0
-                    results_list[i] = (score[0], pp_value)
+        beatmaps: dict[int, Beatmap] = dict(parsed) if parsed else {}
 
-            with engine.connect() as conn:
-                conn.execute(text(STATEMENT_UPDATE_SCORES), [{"pp": result[1], "id": result[0]} for result in results_list])
-                conn.commit()
-        tqdm.update(scores_num)
+        def load_beatmap(gm: int) -> Beatmap:
+            if gm not in beatmaps:
+                beatmaps[gm] = _parse_beatmap(content, gm, stats)
+            return beatmaps[gm]
+
+        results_list: list[tuple[int, float, float | None, float]] = []
+        for mode, scores in groups.items():
+            try:
+                cache_started = time.perf_counter()
+                cached = attr_cache.lookup(beatmap_hash, mode % 4) if attr_cache else {}
+                calc_started = time.perf_counter()
+                load_seconds = stats["parse_seconds"] + stats["convert_seconds"]
+                results, new_entries = _process_group(mode, scores, load_beatmap, cached, stats, pp_epsilon)
+                if rows is not None:
+                    rows.extend((score_id, map_id, mode, old_pp, pp, stars) for score_id, pp, old_pp, stars in results)
+                else:
+                    results_list.extend(results)
+                calc_finished = time.perf_counter()
+                load_seconds = stats["parse_seconds"] + stats["convert_seconds"] - load_seconds
+                stats["calc_seconds"] += calc_finished - calc_started - load_seconds
+                if attr_cache and (new_entries or cached):
+                    attr_cache.store(beatmap_hash, mode % 4, new_entries)
+                stats["cache_seconds"] += calc_started - cache_started + time.perf_counter() - calc_finished
+            except Exception as e:
+                stats["errors"] += 1
+                logging.error(f"Error processing group for map ID {map_id} and mode {mode}: {e}")
+
+        if rows is None:
+            write_started = time.perf_counter()
+            with engine.connect() as conn:  # type: ignore[union-attr]
+                write_scores_pp(conn, results_list, write_mode, write_chunk_size)
+            stats["write_seconds"] += time.perf_counter() - write_started
     except Exception as e:
-        logging.error(f"Error processing group for map ID {map_id} and mode {mode}: {e}")
+        stats["errors"] += 1
+        logging.error(f"Error processing map ID {map_id}: {e}")
+    stats["map_seconds"] += time.perf_counter() - started
+    return stats, rows
+
+
+def process_map(
+    map_id: int,
+    groups: ScoreGroups,
+    content: bytes,
+    beatmap_hash: str,
+    engine: Engine,
+    attr_cache: AttributeCache | None = None,
+    write_mode: enums.WriteMode = enums.WriteMode.Row,
+    pp_epsilon: float | None = 0.001,
+) -> Counter:
+    """
+    Recalculate and write the scores of one map from its .osu content, returns the map's stats (errors included).
+    """
+    stats, _ = _process_map(map_id, groups, content, beatmap_hash, engine, attr_cache, write_mode, 10000, pp_epsilon)
+    return stats
+
+
+def _map_id_ranges(engine: Engine, shards: int) -> list[tuple[int, int | None]]:
+    """
+    Split the maps table into contiguous [start, end) id ranges, one per fetch shard.
+    """
+    if shards <= 1:
+        return [(0, None)]
+    with engine.connect() as conn:
+        lowest, highest = conn.execute(text(STATEMENT_MAP_ID_BOUNDS)).one()
+    if lowest is None:
+        return [(0, None)]
+    step = max(1, math.ceil((highest - lowest + 1) / shards))
+    ranges: list[tuple[int, int | None]] = [(start, start + step) for start in range(lowest, highest + 1, step)]
+    ranges[0] = (0, ranges[0][1])
+    ranges[-1] = (ranges[-1][0], None)
+    return ranges
 
 
 def qb_process_scores(
@@ -98,45 +279,368 @@ def qb_process_scores(
     user_ids: Optional[list[int]] = None,
     time_after: Optional[int] = None,
     time_before: Optional[int] = None,
-) -> None:
-    logging.info("Processing scores.")
-    count, count_params = qb_count_scores(
-        score_modes=[int(mode.value) for mode in score_modes] if score_modes else None,
-        map_modes=[int(mode.value) for mode in map_modes] if map_modes else None,
-        score_statuses=[int(status.value) for status in score_statuses] if score_statuses else None,
-        map_statuses=[int(status.value) for status in map_statuses] if map_statuses else None,
-        user_ids=user_ids,
-        time_after=time_after,
-        time_before=time_before,
+    map_ids: Optional[list[int]] = None,
+    shard: Optional[tuple[int, int]] = None,
+    workers: int = 4,
+    executor: enums.ExecutorKind = enums.ExecutorKind.Thread,
+    max_inflight_groups: Optional[int] = 256,
+    max_inflight_scores: Optional[int] = None,
+    attr_cache: Optional[AttributeCache] = None,
+    write_mode: enums.WriteMode = enums.WriteMode.Row,
+    write_chunk_size: int = 10000,
+    pp_epsilon: Optional[float] = 0.001,
+    checkpoint: Optional[Checkpoint] = None,
+    fetch_shards: int = 1,
+    fetch_mode: enums.FetchMode = enums.FetchMode.Json,
+    prefetch_workers: int = 8,
+    missing_maps_output: Optional[str] = None,
+    metrics: Optional[Metrics] = None,
+    sink: Optional[ResultSink] = None,
+    index: Optional[BeatmapIndex] = None,
+    manifest: Optional[Manifest] = None,
+    writer_threads: int = 2,
+    write_queue_size: int = 64,
+    write_flush_rows: int = 5000,
+    write_flush_seconds: float = 1.0,
+    split_scores: Optional[int] = 20000,
+) -> set[int]:
+    """
+    Recalculate the pp of every score in scope, returns the ids of the maps where any score's pp changed.
+    Counts and per stage seconds (see _process_map, plus fetch, decode and queue wait on the reader side) go to metrics.
+    With a sink nothing is written to the database, the results are streamed to the sink instead (a dry run),
+    every score in scope including the unchanged ones: pp_epsilon only saves writes and is ignored.
+    Maps processed without errors are recorded in the manifest, if given.
+    A (index, count) shard only covers the maps whose md5 falls into that slice, see ShardCoordinator.
+    With writer_threads the pp values are written by a WriterStage instead of the compute workers,
+    which coalesces the results of many maps into one transaction per write_flush_rows rows or write_flush_seconds.
+    Maps with more than split_scores scores are read first, largest first, and cut into parts computed in parallel.
+    """
+    logging.info(f"Processing scores with {workers} {executor.value} workers and {fetch_shards} fetch shards.")
+    if sink:
+        pp_epsilon = None
+    filters = {
+        "score_modes": [int(mode.value) for mode in score_modes] if score_modes else None,
+        "map_modes": [int(mode.value) for mode in map_modes] if map_modes else None,
+        "score_statuses": [int(status.value) for status in score_statuses] if score_statuses else None,
+        "map_statuses": [int(status.value) for status in map_statuses] if map_statuses else None,
+        "user_ids": user_ids,
+        "time_after": time_after,
+        "time_before": time_before,
+        "map_ids": map_ids,
+        "shard_index": shard[0] if shard else None,
+        "shard_count": shard[1] if shard else None,
+    }
+    # Every shard streams one map id range, resumed streams start after the range's checkpoint watermark.
+    shard_ranges: list[tuple[int, int | None, int | None]] = []
+    for start, end in _map_id_ranges(engine, fetch_shards):
+        after = checkpoint.resume_after(start) if checkpoint else None
+        shard_ranges.append((start, after if after is not None else (start - 1 if start > 0 else None), end))
+    # The few maps with far more scores than the rest would finish last on a single worker each. They get a reader
+    # of their own that fetches them one by one, largest first, so their parts are spread over the workers early on.
+    large_maps: list[tuple[int, int]] = []
+    if split_scores:
+        sizes, sizes_params = qb_score_sizes(**filters, min_scores=split_scores + 1)
+        with engine.connect() as conn:
+            large_maps = [(row[0], row[1]) for row in conn.execute(text(sizes), sizes_params)]
+        # Range watermarks only pass large maps once they are done, those behind one are not read again either.
+        large_maps = [(map_id, scores_num) for map_id, scores_num in large_maps if not (checkpoint and checkpoint.finished(map_id))]
+        if large_maps:
+            logging.info(f"{len(large_maps)} maps have over {split_scores} scores, processing them first in parts.")
+    # Maps an earlier run skipped for a missing .osu file are behind the watermarks, a resume reads them again.
+    retry_ids = sorted(set(checkpoint.missing) - {map_id for map_id, _ in large_maps}) if checkpoint else []
+    if retry_ids:
+        logging.info(f"Retrying {len(retry_ids)} maps whose .osu file was missing when the checkpoint was written.")
+    apart = [map_id for map_id, _ in large_maps] + retry_ids
+    range_filters = {**filters, "exclude_map_ids": apart or None}
+    total = sum(scores_num for _, scores_num in large_maps)
+    for _, after, end in shard_ranges:
+        count, count_params = qb_count_scores(**range_filters, map_id_after=after, map_id_before=end)
+        total += statements.fetch_count(engine, count, count_params)
+    if retry_ids:
+        count, count_params = qb_count_scores(**{**filters, "map_ids": retry_ids})
+        total += statements.fetch_count(engine, count, count_params)
+    index = index if index is not None else BeatmapIndex.scan(map_path)
+    missing_maps: list[int] = []
+    progress_bar = tqdm(total=total)
+    # Reads .osu files ahead of the compute workers, the look-ahead window is bounded by the in-flight limiter.
+    prefetcher = ThreadPoolExecutor(max_workers=prefetch_workers, thread_name_prefix="nyamatrix-prefetch")
+    pool = _create_executor(engine, executor, workers)
+    # Process workers open their own engine, threads share ours.
+    worker_engine = engine if executor == enums.ExecutorKind.Thread else None
+    # The readers block here once too much decoded work is waiting for the workers.
+    limiter = InflightLimiter(max_groups=max_inflight_groups, max_scores=max_inflight_scores)
+    metrics = metrics if metrics is not None else Metrics()
+    stats = metrics.counters
+    changed_maps: set[int] = set()
+    changed_lock = threading.Lock()
+    sink_lock = threading.Lock()
+    writer = (
+        WriterStage(
+            engine,
+            lambda conn, rows: write_scores_pp(conn, [(row[0], row[4]) for row in rows], write_mode, write_chunk_size, commit=False),
+            writer_threads,
+            write_queue_size,
+            write_flush_rows,
+            write_flush_seconds,
+        )
+        if writer_threads and not sink
+        else None
     )
-    progress_bar = tqdm(total=statements.fetch_count(engine, count, count_params))
-    pool = ThreadPoolExecutor(max_workers=4)
-    with engine.connect() as conn:
-        connection = conn.execution_options(stream_results=True, max_row_buffer=10000)
-        query, query_params = qb_group_scores(
-            score_modes=[int(mode.value) for mode in score_modes] if score_modes else None,
-            map_modes=[int(mode.value) for mode in map_modes] if map_modes else None,
-            score_statuses=[int(status.value) for status in score_statuses] if score_statuses else None,
-            map_statuses=[int(status.value) for status in map_statuses] if map_statuses else None,
-            user_ids=user_ids,
-            time_after=time_after,
-            time_before=time_before,
+
+    def finish_map(stream: int, map_id: int, scores_num: int, map_stats: Counter, release: bool = True) -> None:
+        metrics.observe_map(map_id, map_stats)
+        if map_stats["changed"]:
+            with changed_lock:
+                changed_maps.add(map_id)
+        if checkpoint and not map_stats["errors"]:
+            checkpoint.completed(stream, map_id)
+        if manifest is not None and not map_stats["errors"]:
+            manifest.record_read(index, map_id)
+        progress_bar.update(scores_num)
+        if release:
+            limiter.release(scores_num)
+
+    def part_done(stream: int, map_id: int, scores_num: int, map_stats: Counter, parts: Optional[MapParts], release: bool) -> None:
+        if parts is not None and (map_stats := parts.done(map_stats)) is None:
+            return
+        finish_map(stream, map_id, scores_num, map_stats, release)
+
+    def on_written(
+        error: Optional[BaseException],
+        seconds: float,
+        stream: int,
+        map_id: int,
+        scores_num: int,
+        map_stats: Counter,
+        parts: Optional[MapParts],
+    ) -> None:
+        map_stats["write_seconds"] += seconds
+        map_stats["map_seconds"] += seconds
+        if error:
+            map_stats["errors"] += 1
+            logging.error(f"Failed to write pp for map ID {map_id}: {error}")
+        part_done(stream, map_id, scores_num, map_stats, parts, release=parts is not None)
+
+    def on_group_done(future: Future, stream: int, map_id: int, scores_num: int, parts: Optional[MapParts]) -> None:
+        if exc := future.exception():
+            logging.error(f"Worker failed to process map ID {map_id}: {exc}")
+            map_stats, rows = Counter(errors=1), None
+        else:
+            map_stats, rows = future.result()
+        if sink and rows:
+            with sink_lock:
+                sink.write(rows)
+        if writer and rows:
+            # Never blocks, the readers wait for room in the write queue before taking on more maps (see read_stream).
+            # So the map leaves the in-flight window now instead of after its (coalesced) write.
+            # A split map stays in the window until its last part is written.
+            writer.submit(rows, lambda error, seconds: on_written(error, seconds, stream, map_id, scores_num, map_stats, parts))
+            if parts is None:
+                limiter.release(scores_num)
+            return
+        part_done(stream, map_id, scores_num, map_stats, parts, release=True)
+
+    def on_prefetched(future: Future, stream: int, map_id: int, groups: ScoreGroups, scores_num: int) -> None:
+        if exc := future.exception():
+            limiter.release(scores_num)
+            metrics.inc("errors")
+            logging.error(f"Failed to read beatmap for map ID {map_id}: {exc}")
+            return
+        content, beatmap_hash = future.result()
+        batches = [groups]
+        parts = None
+        parsed = None
+        if split_scores and scores_num > split_scores:
+            batches = split_groups(groups, split_scores)
+            parts = MapParts(len(batches), len(groups))
+            if executor == enums.ExecutorKind.Thread:
+                # Parsed once for every part, rosu-pp-py objects can not be handed to process workers.
+                try:
+                    parsed = {gm: _parse_beatmap(content, gm, parts.stats) for gm in {mode % 4 for mode in groups}}
+                except Exception as e:
+                    logging.error(f"Failed to parse beatmap for map ID {map_id}, parsing it in every part: {e}")
+        for batch in batches:
+            compute = pool.submit(
+                _process_map,
+                map_id,
+                batch,
+                content,
+                beatmap_hash,
+                worker_engine,
+                attr_cache,
+                write_mode,
+                write_chunk_size,
+                pp_epsilon,
+                sink is not None or writer is not None,
+                parsed,
+            )
+            compute.add_done_callback(lambda f: on_group_done(f, stream, map_id, scores_num, parts))
+
+    def read_stream(stream: int, queries: list[dict], held: list[int]) -> None:
+        """
+        Read the groups of every query in turn and hand them to the prefetcher. Streams of one map id range
+        are journaled with watermarks, the large and missing maps streams (LARGE_STREAM, MISSING_STREAM)
+        only with their finished maps. The maps of a range read by those (held, ascending) are journaled as pending
+        in its stream where they belong, so the range's watermark does not pass them before they are finished.
+        """
+        held_maps = deque(held)
+        with engine.connect() as conn:
+            if fetch_mode == enums.FetchMode.Rows:
+                connection = conn.execution_options(stream_results=True, max_row_buffer=10000)
+                build, iter_groups = qb_score_rows, iter_row_groups
+            else:
+                connection = conn.execution_options(stream_results=True, max_row_buffer=min(max_inflight_groups or 10000, 10000))
+                build, iter_groups = qb_group_scores, iter_json_groups
+            # Reader side seconds are summed locally and handed to metrics every so often.
+            shard_stats: Counter = Counter()
+            for query_filters in queries:
+                query, query_params = build(**query_filters)
+                with connection.execute(text(query), query_params) as result:
+                    waited, decoded = time.perf_counter(), shard_stats["decode_seconds"]
+                    for beatmap_id, groups, scores_num in iter_groups(result, shard_stats):
+                        # Waiting on the stream covers the MySQL fetch, minus what iter_groups spent decoding.
+                        shard_stats["fetch_seconds"] += time.perf_counter() - waited - (shard_stats["decode_seconds"] - decoded)
+                        shard_stats["fetched_maps"] += 1
+                        if shard_stats["fetched_maps"] % 256 == 0:
+                            metrics.update(shard_stats)
+                            shard_stats.clear()
+                        waited, decoded = time.perf_counter(), shard_stats["decode_seconds"]
+                        if checkpoint and beatmap_id in checkpoint.done:
+                            progress_bar.update(scores_num)
+                            continue
+                        if checkpoint and stream >= 0:
+                            while held_maps and held_maps[0] < beatmap_id:
+                                checkpoint.submitted(stream, held_maps.popleft())
+                            checkpoint.submitted(stream, beatmap_id)
+                        if beatmap_id not in index:
+                            # Journaled as missing, not done: the watermark moves on and a resume retries the map.
+                            if checkpoint:
+                                checkpoint.completed(stream, beatmap_id, missing=True)
+                            missing_maps.append(beatmap_id)
+                            shard_stats["missing_maps"] += 1
+                            progress_bar.update(scores_num)
+                            continue
+                        if writer:
+                            # Backpressure from the writers is applied here, their queue never blocks a worker.
+                            writer.wait_for_room()
+                        acquire_started = time.perf_counter()
+                        limiter.acquire(scores_num)
+                        shard_stats["queue_wait_seconds"] += time.perf_counter() - acquire_started
+                        future = prefetcher.submit(index.read, beatmap_id)
+                        future.add_done_callback(lambda f, i=beatmap_id, g=groups, n=scores_num: on_prefetched(f, stream, i, g, n))
+                        waited = time.perf_counter()
+            if checkpoint:
+                while held_maps:
+                    checkpoint.submitted(stream, held_maps.popleft())
+            metrics.update(shard_stats)
+
+    held_ids = sorted(apart)
+    streams = [
+        (
+            f"map ID range {start}-{end}",
+            start,
+            [{**range_filters, "map_id_after": after, "map_id_before": end}],
+            [map_id for map_id in held_ids if (after is None or map_id > after) and (end is None or map_id < end)],
+        )
+        for start, after, end in shard_ranges
+    ]
+    if retry_ids:
+        streams.insert(0, ("the maps missing a .osu file before", MISSING_STREAM, [{**filters, "map_ids": retry_ids}], []))
+    if large_maps:
+        streams.insert(
+            0, ("the largest maps", LARGE_STREAM, [{**filters, "map_ids": [map_id]} for map_id, _ in large_maps], [])
         )
-        with connection.execute(text(query), query_params) as result:
-            for v in result:
-                beatmap_id, score_mode, scores = v
-                pool.submit(
-                    _process_group,
-                    beatmap_id,
-                    score_mode,
-                    json.loads(scores),
-                    map_path,
-                    progress_bar,
-                    engine,
-                )
+    with ThreadPoolExecutor(max_workers=len(streams), thread_name_prefix="nyamatrix-reader") as readers:
+        for label, future in [
+            (label, readers.submit(read_stream, stream, queries, held)) for label, stream, queries, held in streams
+        ]:
+            if exc := future.exception():
+                metrics.inc("errors")
+                logging.error(f"Failed to read scores for {label}: {exc}")
+    prefetcher.shutdown(wait=True)
     pool.shutdown(wait=True)
+    if writer:
+        writer.close()
+        metrics.update(
+            Counter(
+                write_queue_wait_seconds=writer.queue_wait_seconds,
+                write_flushes=writer.flushes,
+                write_commits=writer.commits,
+                write_retries=writer.retries,
+            )
+        )
+        logging.info(f"Wrote pp values in {writer.flushes} flushes and {writer.commits} commits.")
+    progress_bar.close()
+    report_missing(missing_maps, missing_maps_output)
+    if checkpoint:
+        checkpoint.close()
+    if stats["errors"]:
+        logging.warning(f"{stats['errors']} errors while processing scores, the affected maps are retried on --resume.")
+    if attr_cache:
+        logging.info(f"Attribute cache: {stats['attr_cache_hits']} hits, {stats['attr_cache_misses']} misses.")
+        attr_cache.evict()
+    logging.info(
+        f"Difficulty attributes: {stats['difficulty_calcs']} calculated, {stats['difficulty_reuses']} reused "
+        f"({stats['difficulty_canonical_reuses']} across mods with the same difficulty), "
+        f"{stats['score_memo_hits']} scores identical to an earlier one of their group."
+    )
+    logging.info(f"Scores with changed pp: {stats['changed']}, unchanged and skipped: {stats['unchanged']}.")
+    logging.info(f"Finished processing scores ({stats['beatmap_parses']} beatmap parses).")
+    return changed_maps
+
+
+def apply_results(
+    engine: Engine,
+    path: str,
+    write_mode: enums.WriteMode = enums.WriteMode.Bulk,
+    write_chunk_size: int = 10000,
+    chunk_sleep: float = 0,
+) -> set[int]:
+    """
+    Write the new pp of a ResultSink file to the scores table in chunks, returns the ids of the maps it touched.
+    """
+    logging.info(f"Applying results from {path}.")
+    map_ids: set[int] = set()
+    progress_bar = tqdm()
+    with engine.connect() as conn:
+        batch: list[tuple[int, float]] = []
+        for score_id, map_id, _, _, new_pp, _ in iter_results(path):
+            map_ids.add(map_id)
+            batch.append((score_id, new_pp))
+            if len(batch) >= write_chunk_size:
+                write_scores_pp(conn, batch, write_mode, write_chunk_size)
+                progress_bar.update(len(batch))
+                batch = []
+                if chunk_sleep:
+                    time.sleep(chunk_sleep)
+        write_scores_pp(conn, batch, write_mode, write_chunk_size)
+        progress_bar.update(len(batch))
     progress_bar.close()
-    logging.info("Finished processing scores.")
+    logging.info(f"Applied results to {len(map_ids)} maps.")
+    return map_ids
+
+
+def map_user_ids(
+    engine: Engine,
+    map_ids: Iterable[int],
+    *,
+    score_modes: Optional[list[enums.BanchoPyMode]] = None,
+    user_ids: Optional[list[int]] = None,
+    chunk_size: int = 1000,
+) -> list[int]:
+    """
+    The users with scores on any of the given maps, narrowed to user_ids if given.
+    """
+    map_ids = sorted(map_ids)
+    modes = [int(mode.value) for mode in score_modes] if score_modes else None
+    found: set[int] = set()
+    with engine.connect() as conn:
+        for i in range(0, len(map_ids), chunk_size):
+            q, b = qb_map_users(map_ids=map_ids[i : i + chunk_size], score_modes=modes)
+            found.update(row[0] for row in conn.execute(text(q), b))
+    if user_ids:
+        found &= set(user_ids)
+    return sorted(found)
 
 
 def qb_process_score_status(
@@ -146,26 +650,105 @@ def qb_process_score_status(
     map_modes: Optional[list[enums.GameMode]] = None,
     score_statuses: Optional[list[enums.ScoreStatus]] = None,
     user_ids: Optional[list[int]] = None,
+    map_ids: Optional[Iterable[int]] = None,
     time_after: Optional[int] = None,
     time_before: Optional[int] = None,
     update_failed_scores: Optional[bool] = False,
+    chunk: enums.StatusChunk = enums.StatusChunk.Off,
+    chunk_size: int = 1000,
+    chunk_sleep: float = 0,
 ) -> None:
-    logging.info("Processing full table scores status (waiting for mysql).")
-    with engine.connect() as conn:
-        q, b = qb_update_score_status(
-            score_modes=[int(mode.value) for mode in score_modes] if score_modes else None,
-            map_modes=[int(mode.value) for mode in map_modes] if map_modes else None,
-            score_statuses=[int(status.value) for status in score_statuses] if score_statuses else None,
-            user_ids=user_ids,
-            time_after=time_after,
-            time_before=time_before,
-            update_failed_scores=update_failed_scores,
+    """
+    Re-pick the best (status = 2) score of every (user, mode, map) in scope.
+    Chunked modes run one statement per user id range (or batch of the given users) or per batch of maps,
+    so each only windows over the partitions of its chunk and holds its row locks briefly.
+    """
+    if map_ids is not None:
+        map_ids = sorted(map_ids)
+        if not map_ids:
+            logging.info("No map had its scores changed, skipping status.")
+            return
+    filters = {
+        "score_modes": [int(mode.value) for mode in score_modes] if score_modes else None,
+        "map_modes": [int(mode.value) for mode in map_modes] if map_modes else None,
+        "score_statuses": [int(status.value) for status in score_statuses] if score_statuses else None,
+        "user_ids": user_ids,
+        "map_ids": map_ids,
+        "time_after": time_after,
+        "time_before": time_before,
+        "update_failed_scores": update_failed_scores,
+    }
+    if chunk == enums.StatusChunk.Off:
+        logging.info("Processing scores status (waiting for mysql).")
+        with engine.connect() as conn:
+            q, b = qb_update_score_status(**filters)
+            conn.execute(text(q), b)
+            conn.commit()
+        logging.info("Finished processing status.")
+        return
+
+    if chunk == enums.StatusChunk.Users and not user_ids:
+        logging.info(f"Processing scores status in user id ranges of {chunk_size}.")
+        run_chunked(
+            engine,
+            list(id_ranges(engine, "users", chunk_size)),
+            lambda r: qb_update_score_status(**filters, user_id_min=r[0], user_id_max=r[1]),
+            sleep=chunk_sleep,
+            size=lambda r: r[1] - r[0] + 1,
+        )
+    else:
+        key = "user_ids" if chunk == enums.StatusChunk.Users else "map_ids"
+        keys = filters[key]
+        if keys is None:
+            with engine.connect() as conn:
+                keys = [row[0] for row in conn.execute(text(STATEMENT_FETCH_MAP_IDS))]
+        logging.info(f"Processing scores status for {len(keys)} {chunk.value} in chunks of {chunk_size}.")
+        run_chunked(
+            engine,
+            [keys[i : i + chunk_size] for i in range(0, len(keys), chunk_size)],
+            lambda batch: qb_update_score_status(**{**filters, key: batch}),
+            sleep=chunk_sleep,
+            size=len,
         )
-        conn.execute(text(q), b)
-        conn.commit()
     logging.info("Finished processing status.")
 
 
+def _stream_user_pp(
+    engine: Engine,
+    modes: Optional[list[int]],
+    user_ids: Optional[list[int]],
+    write_mode: enums.WriteMode,
+    write_chunk_size: int,
+    chunk_sleep: float = 0,
+) -> None:
+    """
+    Client side pp/acc engine: merges the ordered stats keys with the ordered best scores stream,
+    weighs every user in Python and writes stats in chunks.
+    """
+    keys_query, keys_params = qb_user_stats_keys(modes=modes, user_ids=user_ids)
+    scores_query, scores_params = qb_user_best_scores(modes=modes, user_ids=user_ids)
+    progress_bar = tqdm(total=statements.fetch_count(engine, f"SELECT COUNT(*) FROM ({keys_query}) k", keys_params))
+    with engine.connect() as keys_conn, engine.connect() as scores_conn, engine.connect() as write_conn:
+        keys_connection = keys_conn.execution_options(stream_results=True, max_row_buffer=10000)
+        scores_connection = scores_conn.execution_options(stream_results=True, max_row_buffer=10000)
+        with (
+            keys_connection.execute(text(keys_query), keys_params) as keys,
+            scores_connection.execute(text(scores_query), scores_params) as scores,
+        ):
+            batch: list[tuple[int, int, float, float]] = []
+            for row in iter_user_stats(keys, scores):
+                batch.append(row)
+                if len(batch) >= write_chunk_size:
+                    write_user_stats(write_conn, batch, write_mode, write_chunk_size)
+                    progress_bar.update(len(batch))
+                    batch = []
+                    if chunk_sleep:
+                        time.sleep(chunk_sleep)
+            write_user_stats(write_conn, batch, write_mode, write_chunk_size)
+            progress_bar.update(len(batch))
+    progress_bar.close()
+
+
 def qb_process_user_statistics(
     engine: Engine,
     redis: Redis,
@@ -174,37 +757,82 @@ def qb_process_user_statistics(
     calc_pp: Optional[bool] = None,
     slow_statistics: Optional[bool] = None,
     very_slow_statistics: Optional[bool] = None,
-    user_ids: Optional[list[int]] = None,  # TODO
+    user_ids: Optional[list[int]] = None,
+    stats_engine: enums.StatsEngine = enums.StatsEngine.Sql,
+    write_mode: enums.WriteMode = enums.WriteMode.Row,
+    write_chunk_size: int = 10000,
+    chunk_size: Optional[int] = None,
+    chunk_sleep: float = 0,
 ) -> None:
-    logging.info("Processing full table user statistics (waiting for mysql).")
-    with engine.connect() as conn:
-        q, b = qb_update_user_statistics(
-            modes=[int(mode.value) for mode in score_modes] if score_modes else None,
-            calc_pp=calc_pp,
-            slow_statistics=slow_statistics,
-            very_slow_statistics=very_slow_statistics,
-        )
-        if q is None:
-            return
-        conn.execute(text(q), b)
-        conn.commit()
+    """
+    Recalculate stats rows and the redis leaderboards.
+    With chunk_size the stats UPDATE runs per user id range (or batch of the given users), committing every chunk.
+    """
+    modes = [int(mode.value) for mode in score_modes] if score_modes else None
+    stream_pp = bool(calc_pp) and stats_engine == enums.StatsEngine.Stream
+    q, b = qb_update_user_statistics(
+        modes=modes,
+        calc_pp=calc_pp and not stream_pp,
+        slow_statistics=slow_statistics,
+        very_slow_statistics=very_slow_statistics,
+        user_ids=user_ids,
+    )
+    if q is None and not stream_pp:
+        return
+    scope = f"{len(user_ids)} users" if user_ids else "full table"
+    if stream_pp:
+        logging.info(f"Processing {scope} user pp (streaming).")
+        _stream_user_pp(engine, modes, user_ids, write_mode, write_chunk_size, chunk_sleep)
+    if q is not None and chunk_size:
+        statistics = {
+            "modes": modes,
+            "calc_pp": calc_pp and not stream_pp,
+            "slow_statistics": slow_statistics,
+            "very_slow_statistics": very_slow_statistics,
+        }
+        if user_ids:
+            logging.info(f"Processing {scope} user statistics in chunks of {chunk_size}.")
+            run_chunked(
+                engine,
+                [user_ids[i : i + chunk_size] for i in range(0, len(user_ids), chunk_size)],
+                lambda batch: qb_update_user_statistics(**statistics, user_ids=batch),
+                sleep=chunk_sleep,
+                size=len,
+            )
+        else:
+            logging.info(f"Processing {scope} user statistics in user id ranges of {chunk_size}.")
+            run_chunked(
+                engine,
+                list(id_ranges(engine, "users", chunk_size)),
+                lambda r: qb_update_user_statistics(**statistics, user_id_min=r[0], user_id_max=r[1]),
+                sleep=chunk_sleep,
+                size=lambda r: r[1] - r[0] + 1,
+            )
+    elif q is not None:
+        logging.info(f"Processing {scope} user statistics (waiting for mysql).")
+        with engine.connect() as conn:
+            conn.execute(text(q), b)
+            conn.commit()
     logging.info("Writing leaderboard to redis.")
+    modes = modes or [0, 1, 2, 3, 4, 5, 6, 8]
+    scoped = " AND s.id IN :user_ids" if user_ids else ""
     progress_bar = tqdm(
-        total=statements.fetch_count(
-            engine,
-            STATEMENT_COUNT_USER_STATISTICS,
-            {"modes": [int(mode.value) for mode in score_modes] if score_modes else [0, 1, 2, 3, 4, 5, 6, 8]},
-        )
+        total=statements.fetch_count(engine, STATEMENT_COUNT_USER_STATISTICS + scoped, {"modes": modes, "user_ids": user_ids})
     )
+    # A scoped run must not rebuild (and so truncate) the boards, it updates the affected users in place.
+    leaderboard = LeaderboardWriter(redis, modes, partial=bool(user_ids))
     with engine.connect() as conn:
         connection = conn.execution_options(stream_results=True, max_row_buffer=1000)
         with connection.execute(
-            text(STATEMENT_FETCH_USER_STATISTICS),
-            {"modes": [int(mode.value) for mode in score_modes] if score_modes else [0, 1, 2, 3, 4, 5, 6, 8]},
+            text(STATEMENT_FETCH_USER_STATISTICS + scoped),
+            {"modes": modes, "user_ids": user_ids},
         ) as result:
             for row in result:
                 if row[4] & 1 << 0:  # unrestricted
-                    redis.zadd(f"bancho:leaderboard:{row[1]}", {str(row[0]): row[2]})
-                    redis.zadd(f"bancho:leaderboard:{row[1]}:{row[3]}", {str(row[0]): row[2]})
+                    leaderboard.add(row[1], row[3], row[0], row[2])
+                elif user_ids:
+                    leaderboard.remove(row[1], row[3], row[0])
                 progress_bar.update(1)
+    leaderboard.commit()
+    progress_bar.close()
     logging.info("Finished processing user statistics.")
@@ -10,6 +10,12 @@ def count(
     user_ids: Optional[list[int]] = None,
     time_after: Optional[int] = None,
     time_before: Optional[int] = None,
+    map_id_after: Optional[int] = None,
+    map_id_before: Optional[int] = None,
+    map_ids: Optional[list[int]] = None,
+    shard_index: Optional[int] = None,
+    shard_count: Optional[int] = None,
+    exclude_map_ids: Optional[list[int]] = None,
 ):
     _q = """
     SELECT
@@ -26,6 +32,11 @@ def count(
             "AND s.userid IN :user_ids" if user_ids else "",
             "AND m.status IN :map_statuses" if map_statuses else "",
             "AND m.mode IN :map_modes" if map_modes else "",
+            "AND m.id > :map_id_after" if map_id_after is not None else "",
+            "AND m.id < :map_id_before" if map_id_before is not None else "",
+            "AND m.id IN :map_ids" if map_ids else "",
+            "AND CRC32(s.map_md5) % :shard_count = :shard_index" if shard_count else "",
+            "AND m.id NOT IN :exclude_map_ids" if exclude_map_ids else "",
             (
                 "AND s.time BETWEEN :time_after AND :time_before"
                 if time_after is not None and time_before is not None
@@ -46,6 +57,12 @@ def count(
         "user_ids": user_ids,
         "time_after": time_after,
         "time_before": time_before,
+        "map_id_after": map_id_after,
+        "map_id_before": map_id_before,
+        "map_ids": map_ids,
+        "shard_index": shard_index,
+        "shard_count": shard_count,
+        "exclude_map_ids": exclude_map_ids,
     }
 
 
@@ -58,14 +75,20 @@ def query(
     user_ids: Optional[list[int]] = None,
     time_after: Optional[int] = None,
     time_before: Optional[int] = None,
+    map_id_after: Optional[int] = None,
+    map_id_before: Optional[int] = None,
+    map_ids: Optional[list[int]] = None,
+    shard_index: Optional[int] = None,
+    shard_count: Optional[int] = None,
+    exclude_map_ids: Optional[list[int]] = None,
 ):
     _q = (
         """
     SELECT
         m.id,
-        s.mode,
         JSON_ARRAYAGG(
             JSON_ARRAY(
+                s.mode,
                 s.id,
                 s.mods,
                 s.max_combo,
@@ -74,7 +97,8 @@ def query(
                 s.nkatu,
                 s.n100,
                 s.n50,
-                s.nmiss
+                s.nmiss,
+                s.pp
             )
         ) ss
     FROM
@@ -90,6 +114,11 @@ def query(
                 "AND s.userid IN :user_ids" if user_ids else "",
                 "AND m.status IN :map_statuses" if map_statuses else "",
                 "AND m.mode IN :map_modes" if map_modes else "",
+                "AND m.id > :map_id_after" if map_id_after is not None else "",
+                "AND m.id < :map_id_before" if map_id_before is not None else "",
+                "AND m.id IN :map_ids" if map_ids else "",
+                "AND CRC32(s.map_md5) % :shard_count = :shard_index" if shard_count else "",
+                "AND m.id NOT IN :exclude_map_ids" if exclude_map_ids else "",
                 (
                     "AND s.time BETWEEN :time_after AND :time_before"
                     if time_after is not None and time_before is not None
@@ -104,7 +133,94 @@ def query(
         )
         + """
     GROUP BY
-      s.map_md5,
+      s.map_md5
+    ORDER BY
+      m.id"""
+    )
+    return _q, {
+        "score_statuses": score_statuses,
+        "map_statuses": map_statuses,
+        "map_modes": map_modes,
+        "score_modes": score_modes,
+        "user_ids": user_ids,
+        "time_after": time_after,
+        "time_before": time_before,
+        "map_id_after": map_id_after,
+        "map_id_before": map_id_before,
+        "map_ids": map_ids,
+        "shard_index": shard_index,
+        "shard_count": shard_count,
+        "exclude_map_ids": exclude_map_ids,
+    }
+
+
+def rows(
+    *,
+    score_modes: Optional[list[int]] = None,
+    map_modes: Optional[list[int]] = None,
+    score_statuses: Optional[list[int]] = None,
+    map_statuses: Optional[list[int]] = None,
+    user_ids: Optional[list[int]] = None,
+    time_after: Optional[int] = None,
+    time_before: Optional[int] = None,
+    map_id_after: Optional[int] = None,
+    map_id_before: Optional[int] = None,
+    map_ids: Optional[list[int]] = None,
+    shard_index: Optional[int] = None,
+    shard_count: Optional[int] = None,
+    exclude_map_ids: Optional[list[int]] = None,
+):
+    """
+    Plain score rows ordered by map and mode, grouped on the client instead of by JSON_ARRAYAGG.
+    """
+    _q = (
+        """
+    SELECT
+        m.id,
+        s.mode,
+        s.id,
+        s.mods,
+        s.max_combo,
+        s.ngeki,
+        s.n300,
+        s.nkatu,
+        s.n100,
+        s.n50,
+        s.nmiss,
+        s.pp
+    FROM
+        scores s
+        INNER JOIN maps m ON s.map_md5 = m.md5
+    WHERE
+    """
+        + "\n".join(
+            v
+            for v in [
+                "s.status IN :score_statuses" if score_statuses else "s.status > 0",
+                "AND s.mode IN :score_modes" if score_modes else "",
+                "AND s.userid IN :user_ids" if user_ids else "",
+                "AND m.status IN :map_statuses" if map_statuses else "",
+                "AND m.mode IN :map_modes" if map_modes else "",
+                "AND m.id > :map_id_after" if map_id_after is not None else "",
+                "AND m.id < :map_id_before" if map_id_before is not None else "",
+                "AND m.id IN :map_ids" if map_ids else "",
+                "AND CRC32(s.map_md5) % :shard_count = :shard_index" if shard_count else "",
+                "AND m.id NOT IN :exclude_map_ids" if exclude_map_ids else "",
+                (
+                    "AND s.time BETWEEN :time_after AND :time_before"
+                    if time_after is not None and time_before is not None
+                    else (
+                        "AND s.time >= :time_after"
+                        if time_after is not None
+                        else ("AND s.time <= :time_before" if time_before is not None else "")
+                    )
+                ),
+            ]
+            if v is not None and v != ""
+        )
+        + """
+    ORDER BY
+      m.id,
       s.mode"""
     )
     return _q, {
@@ -115,6 +231,84 @@ def query(
         "user_ids": user_ids,
         "time_after": time_after,
         "time_before": time_before,
+        "map_id_after": map_id_after,
+        "map_id_before": map_id_before,
+        "map_ids": map_ids,
+        "shard_index": shard_index,
+        "shard_count": shard_count,
+        "exclude_map_ids": exclude_map_ids,
+    }
+
+
+def sizes(
+    *,
+    min_scores: int,
+    score_modes: Optional[list[int]] = None,
+    map_modes: Optional[list[int]] = None,
+    score_statuses: Optional[list[int]] = None,
+    map_statuses: Optional[list[int]] = None,
+    user_ids: Optional[list[int]] = None,
+    time_after: Optional[int] = None,
+    time_before: Optional[int] = None,
+    map_ids: Optional[list[int]] = None,
+    shard_index: Optional[int] = None,
+    shard_count: Optional[int] = None,
+):
+    """
+    (map id, score count) of the maps with at least min_scores scores in scope, largest first.
+    """
+    _q = (
+        """
+    SELECT
+        m.id,
+        count(*) c
+    FROM
+        scores s
+        INNER JOIN maps m ON s.map_md5 = m.md5
+    WHERE
+    """
+        + "\n".join(
+            v
+            for v in [
+                "s.status IN :score_statuses" if score_statuses else "s.status > 0",
+                "AND s.mode IN :score_modes" if score_modes else "",
+                "AND s.userid IN :user_ids" if user_ids else "",
+                "AND m.status IN :map_statuses" if map_statuses else "",
+                "AND m.mode IN :map_modes" if map_modes else "",
+                "AND m.id IN :map_ids" if map_ids else "",
+                "AND CRC32(s.map_md5) % :shard_count = :shard_index" if shard_count else "",
+                (
+                    "AND s.time BETWEEN :time_after AND :time_before"
+                    if time_after is not None and time_before is not None
+                    else (
+                        "AND s.time >= :time_after"
+                        if time_after is not None
+                        else ("AND s.time <= :time_before" if time_before is not None else "")
+                    )
+                ),
+            ]
+            if v is not None and v != ""
+        )
+        + """
+    GROUP BY
+      m.id
+    HAVING
+      c >= :min_scores
+    ORDER BY
+      c DESC"""
+    )
+    return _q, {
+        "min_scores": min_scores,
+        "score_statuses": score_statuses,
+        "map_statuses": map_statuses,
+        "map_modes": map_modes,
+        "score_modes": score_modes,
+        "user_ids": user_ids,
+        "time_after": time_after,
+        "time_before": time_before,
+        "map_ids": map_ids,
+        "shard_index": shard_index,
+        "shard_count": shard_count,
     }
 
 
@@ -0,0 +1,29 @@
+from typing import Optional
+
+
+def query(
+    *,
+    map_ids: list[int],
+    score_modes: Optional[list[int]] = None,
+):
+    """
+    The users who have scores on any of the given maps.
+    """
+    _q = (
+        """
+    SELECT DISTINCT
+        s.userid
+    FROM
+        scores s
+        INNER JOIN maps m ON s.map_md5 = m.md5
+    WHERE
+        m.id IN :map_ids
+        AND s.status > 0
+    """
+        + ("AND s.mode IN :score_modes" if score_modes else "")
+    )
+    return _q, {"map_ids": map_ids, "score_modes": score_modes}
+
+
+if __name__ == "__main__":
+    print(*query(map_ids=[75, 129891], score_modes=[0, 4]))
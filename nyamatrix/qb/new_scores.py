@@ -0,0 +1,70 @@
+from typing import Optional
+
+
+def query(
+    *,
+    score_id_after: int,
+    score_id_upto: int,
+    score_ids: Optional[list[int]] = None,
+    score_modes: Optional[list[int]] = None,
+):
+    """
+    Scores submitted in the (score_id_after, score_id_upto] id window, plus the score_ids given (scores to retry),
+    as plain rows ordered by map and mode like group_scores.rows.
+    """
+    filters = ["(s.id > :score_id_after AND s.id <= :score_id_upto" + (" OR s.id IN :score_ids)" if score_ids else ")")]
+    filters.append("s.status > 0")
+    if score_modes:
+        filters.append("s.mode IN :score_modes")
+    _q = (
+        """
+    SELECT
+        m.id,
+        s.mode,
+        s.id,
+        s.mods,
+        s.max_combo,
+        s.ngeki,
+        s.n300,
+        s.nkatu,
+        s.n100,
+        s.n50,
+        s.nmiss,
+        s.pp
+    FROM
+        scores s
+        INNER JOIN maps m ON s.map_md5 = m.md5
+    WHERE
+        """
+        + "\n        AND ".join(filters)
+        + """
+    ORDER BY
+      m.id,
+      s.mode"""
+    )
+    return _q, {
+        "score_id_after": score_id_after,
+        "score_id_upto": score_id_upto,
+        "score_ids": score_ids,
+        "score_modes": score_modes,
+    }
+
+
+def users(*, score_ids: list[int]):
+    """
+    The users who submitted the given scores.
+    """
+    _q = """
+    SELECT DISTINCT
+        s.userid
+    FROM
+        scores s
+    WHERE
+        s.id IN :score_ids
+    """
+    return _q, {"score_ids": score_ids}
+
+
+if __name__ == "__main__":
+    print(*query(score_id_after=1000, score_id_upto=2000, score_ids=[42, 77], score_modes=[0, 4]))
+    print(*users(score_ids=[1001, 1002]))
@@ -1,16 +1,68 @@
 from typing import Optional
 
 
+def _scope(
+    alias: str,
+    *,
+    score_modes: Optional[list[int]] = None,
+    map_modes: Optional[list[int]] = None,
+    user_ids: Optional[list[int]] = None,
+    map_ids: Optional[list[int]] = None,
+    user_id_min: Optional[int] = None,
+    user_id_max: Optional[int] = None,
+    time_after: Optional[int] = None,
+    time_before: Optional[int] = None,
+) -> str:
+    """
+    Conditions limiting the best score CTEs to the (userid, mode, map_md5) partitions the UPDATE can touch.
+    Only partition keys are filtered, the time window selects partitions rather than rows so older scores still compete.
+    """
+    time = (
+        "time BETWEEN :time_after AND :time_before"
+        if time_after is not None and time_before is not None
+        else ("time >= :time_after" if time_after is not None else ("time <= :time_before" if time_before is not None else ""))
+    )
+    return "\n".join(
+        v
+        for v in [
+            f"AND {alias}.mode IN :score_modes" if score_modes else "",
+            f"AND {alias}.userid IN :user_ids" if user_ids else "",
+            f"AND {alias}.userid BETWEEN :user_id_min AND :user_id_max" if user_id_min is not None else "",
+            f"AND {alias}.map_md5 IN (SELECT md5 FROM maps WHERE id IN :map_ids)" if map_ids else "",
+            f"AND {alias}.map_md5 IN (SELECT md5 FROM maps WHERE mode IN :map_modes)" if map_modes else "",
+            (
+                f"AND ({alias}.userid, {alias}.mode, {alias}.map_md5) IN (SELECT userid, mode, map_md5 FROM scores WHERE {time})"
+                if time
+                else ""
+            ),
+        ]
+        if v is not None and v != ""
+    )
+
+
 def query(
     *,
     score_modes: Optional[list[int]] = None,
     map_modes: Optional[list[int]] = None,
     score_statuses: Optional[list[int]] = None,
     user_ids: Optional[list[int]] = None,
+    map_ids: Optional[list[int]] = None,
+    user_id_min: Optional[int] = None,
+    user_id_max: Optional[int] = None,
     time_after: Optional[int] = None,
     time_before: Optional[int] = None,
     update_failed_scores: Optional[bool] = False,
 ):
+    scope = {
+        "score_modes": score_modes,
+        "map_modes": map_modes,
+        "user_ids": user_ids,
+        "map_ids": map_ids,
+        "user_id_min": user_id_min,
+        "user_id_max": user_id_max,
+        "time_after": time_after,
+        "time_before": time_before,
+    }
     _q = (
         """
     WITH MAX AS (
@@ -20,10 +72,13 @@ def query(
             max(pp) AS max_pp,
             map_md5
         FROM
-            scores
+            scores s1
         WHERE
             grade != 'F' -- make sure early exited scores are not in considering
             -- AND max_pp > 0 -- no perf gain
+    """
+        + _scope("s1", **scope)
+        + """
         GROUP BY
             userid,
             mode,
@@ -51,6 +106,9 @@ def query(
         WHERE
             s2.pp > 0
             AND s2.grade != 'F' -- edge case: same pp, failed scores, higher score
+    """
+        + _scope("s2", **scope)
+        + """
     ),
     MAX_PPS AS (
         SELECT
@@ -88,6 +146,8 @@ def query(
                 "AND s.status IN :score_statuses" if score_statuses else "AND s.status > 0",
                 "AND s.mode IN :score_modes" if score_modes else "",
                 "AND s.userid IN :user_ids" if user_ids else "",
+                "AND s.userid BETWEEN :user_id_min AND :user_id_max" if user_id_min is not None else "",
+                "AND s.map_md5 IN (SELECT md5 FROM maps WHERE id IN :map_ids)" if map_ids else "",
                 "AND m.mode IN :map_modes" if map_modes else "",
                 (
                     "AND s.time BETWEEN :time_after AND :time_before"
@@ -104,6 +164,9 @@ def query(
         "score_statuses": score_statuses,
         "score_modes": score_modes,
         "user_ids": user_ids,
+        "map_ids": map_ids,
+        "user_id_min": user_id_min,
+        "user_id_max": user_id_max,
         "map_modes": map_modes,
         "time_after": time_after,
         "time_before": time_before,
@@ -15,6 +15,7 @@ CALC_PP_CTES = """
             s.status = 2
             AND m.status IN (2, 3)
             AND s.pp > 0
+            {scope}
         ORDER BY
             s.pp DESC,
             s.acc DESC,
@@ -76,6 +77,9 @@ CONCRETE_STATS_CTES = """
             SUM(s.grade = "A") AS a_count
         FROM
             scores s
+        WHERE
+            1 = 1
+            {scope}
         GROUP BY
             s.userid,
             s.mode
@@ -93,6 +97,7 @@ RANKED_STATS_CTES = """
         WHERE
             m.status IN (2, 3)
             AND s.status = 2
+            {scope}
         GROUP BY
             s.userid,
             s.mode
@@ -105,19 +110,33 @@ def query(
     slow_statistics: Optional[bool] = None,
     very_slow_statistics: Optional[bool] = None,
     modes: Optional[List[int]] = None,
+    user_ids: Optional[List[int]] = None,
+    user_id_min: Optional[int] = None,
+    user_id_max: Optional[int] = None,
 ):
     """
     Update user statistics based on the scores table.
     ~1s for 1 user, ~2s for full recalc
     Slow statistics will calculate the total score and play time for each user. ~1s for 1 user, ~3s for full recalc
     Very slow statistics will calculate the ranked score for each user. ~7s for 1 user, ~10s for full recalc
+    The user and mode filters also scope the score CTEs, so a chunk of users only aggregates its own scores.
     """
 
     if not calc_pp and not slow_statistics and not very_slow_statistics:
         return None, {}
 
-    ctes = (
+    scope = "\n".join(
         v
+        for v in [
+            "AND s.mode IN :modes" if modes else None,
+            "AND s.userid IN :user_ids" if user_ids else None,
+            "AND s.userid BETWEEN :user_id_min AND :user_id_max" if user_id_min is not None else None,
+        ]
+        if v is not None
+    )
+
+    ctes = (
+        v.format(scope=scope)
         for v in [
             "dummy AS (SELECT 1)",
             CALC_PP_CTES if calc_pp else None,
@@ -162,6 +181,16 @@ def query(
         if v is not None
     )
 
+    conditions = [
+        v
+        for v in [
+            "s.mode IN :modes" if modes else None,
+            "s.id IN :user_ids" if user_ids else None,
+            "s.id BETWEEN :user_id_min AND :user_id_max" if user_id_min is not None else None,
+        ]
+        if v is not None
+    ]
+
     _q = f"""
     WITH {", ".join(ctes)}
     UPDATE stats s
@@ -169,10 +198,10 @@ def query(
     SET
         {", ".join(updates)}
 """ + (
-        "WHERE s.mode IN :modes" if modes else ""
+        f"WHERE {' AND '.join(conditions)}" if conditions else ""
     )
 
-    return _q, {"modes": modes}
+    return _q, {"modes": modes, "user_ids": user_ids, "user_id_min": user_id_min, "user_id_max": user_id_max}
 
 
 if __name__ == "__main__":
@@ -182,5 +211,6 @@ if __name__ == "__main__":
             slow_statistics=True,
             very_slow_statistics=True,
             modes=[0, 1, 2],
+            user_ids=[1000],
         )
     )
@@ -0,0 +1,81 @@
+from typing import Optional
+
+
+def query(
+    *,
+    modes: Optional[list[int]] = None,
+    user_ids: Optional[list[int]] = None,
+):
+    """
+    Best (status = 2) ranked scores with pp, ordered by user and mode and then by pp as the weighting expects.
+    """
+    _q = (
+        """
+    SELECT
+        s.userid,
+        s.mode,
+        s.pp,
+        s.acc
+    FROM
+        scores s
+        INNER JOIN maps m ON s.map_md5 = m.md5
+    WHERE
+        s.status = 2
+        AND m.status IN (2, 3)
+        AND s.pp > 0
+    """
+        + "\n".join(
+            v
+            for v in [
+                "AND s.mode IN :modes" if modes else "",
+                "AND s.userid IN :user_ids" if user_ids else "",
+            ]
+            if v is not None and v != ""
+        )
+        + """
+    ORDER BY
+        s.userid,
+        s.mode,
+        s.pp DESC,
+        s.acc DESC,
+        s.id DESC"""
+    )
+    return _q, {"modes": modes, "user_ids": user_ids}
+
+
+def keys(
+    *,
+    modes: Optional[list[int]] = None,
+    user_ids: Optional[list[int]] = None,
+):
+    """
+    The stats rows in scope, in the same user and mode order as query().
+    """
+    _q = (
+        """
+    SELECT
+        s.id,
+        s.mode
+    FROM
+        stats s
+    WHERE
+    """
+        + "\n".join(
+            v
+            for v in [
+                "s.mode IN :modes" if modes else "1 = 1",
+                "AND s.id IN :user_ids" if user_ids else "",
+            ]
+            if v is not None and v != ""
+        )
+        + """
+    ORDER BY
+        s.id,
+        s.mode"""
+    )
+    return _q, {"modes": modes, "user_ids": user_ids}
+
+
+if __name__ == "__main__":
+    print(*query(modes=[0, 1], user_ids=[3, 1000]))
+    print(*keys(modes=[0, 1], user_ids=[3, 1000]))
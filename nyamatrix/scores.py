@@ -0,0 +1,112 @@
+import json
+import math
+import time
+from array import array
+from collections import Counter, defaultdict
+from typing import Any, Iterable, Iterator, Optional, Sequence
+
+# Score tuple: id, mods, max_combo, n_geki, n300, n_katu, n100, n50, misses, stored pp
+Score = tuple[int, int, int, int, int, int, int, int, int, Optional[float]]
+ScoreGroups = dict[int, Sequence[Score]]
+
+
+class ScoreBlock:
+    """
+    Scores of one (map, mode) group packed into flat arrays instead of a list of lists.
+    Score ids live in an int64 array, the hit statistics row-major in an int32 array and the stored pp in a float64 array
+    (NaN for NULL), about 48 bytes per score. Iterating yields plain score tuples, pickling sends the raw array buffers.
+    """
+
+    __slots__ = ("ids", "ints", "pps")
+    WIDTH = 8
+
+    def __init__(self):
+        self.ids = array("q")
+        self.ints = array("i")
+        self.pps = array("d")
+
+    def append(self, *score: Any) -> None:
+        self.ids.append(score[0])
+        self.ints.extend(score[1 : self.WIDTH + 1])
+        pp = score[self.WIDTH + 1]
+        self.pps.append(math.nan if pp is None else pp)
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def __iter__(self) -> Iterator[Score]:
+        ints, width = self.ints, self.WIDTH
+        for i, (score_id, pp) in enumerate(zip(self.ids, self.pps)):
+            yield (score_id, *ints[i * width : (i + 1) * width], None if math.isnan(pp) else pp)  # type: ignore
+
+    def __getitem__(self, index: slice) -> "ScoreBlock":
+        start, stop, _ = index.indices(len(self.ids))
+        block = ScoreBlock()
+        block.ids = self.ids[start:stop]
+        block.ints = self.ints[start * self.WIDTH : stop * self.WIDTH]
+        block.pps = self.pps[start:stop]
+        return block
+
+    def __getstate__(self):
+        return self.ids, self.ints, self.pps
+
+    def __setstate__(self, state):
+        self.ids, self.ints, self.pps = state
+
+
+def iter_json_groups(rows: Iterable[Sequence[Any]], stats: Optional[Counter] = None) -> Iterator[tuple[int, ScoreGroups, int]]:
+    """
+    Decode (map id, JSON_ARRAYAGG scores) rows into per mode score groups.
+    The decoding time is added to stats["decode_seconds"] if given.
+    """
+    for map_id, scores in rows:
+        started = time.perf_counter()
+        scores = json.loads(scores)
+        groups: dict[int, list] = defaultdict(list)
+        for score in scores:
+            groups[score[0]].append(score[1:])
+        if stats is not None:
+            stats["decode_seconds"] += time.perf_counter() - started
+        yield map_id, dict(groups), len(scores)
+
+
+def iter_row_groups(rows: Iterable[Sequence[Any]], stats: Optional[Counter] = None) -> Iterator[tuple[int, ScoreGroups, int]]:
+    """
+    Group plain (map id, mode, score columns...) rows ordered by map id into per mode score blocks.
+    Packing is interleaved with fetching the rows, so it is not timed apart and stats is unused.
+    """
+    map_id = None
+    groups: dict[int, ScoreBlock] = {}
+    scores_num = 0
+    for row in rows:
+        if row[0] != map_id:
+            if map_id is not None:
+                yield map_id, groups, scores_num  # type: ignore
+            map_id, groups, scores_num = row[0], {}, 0
+        if (block := groups.get(row[1])) is None:
+            block = groups[row[1]] = ScoreBlock()
+        block.append(*row[2:])
+        scores_num += 1
+    if map_id is not None:
+        yield map_id, groups, scores_num  # type: ignore
+
+
+def split_groups(groups: ScoreGroups, max_scores: int) -> list[ScoreGroups]:
+    """
+    Split the groups of one map into parts of at most max_scores scores, large modes are cut into slices
+    and small ones packed together.
+    """
+    parts: list[ScoreGroups] = []
+    part: dict[int, Sequence[Score]] = {}
+    part_size = 0
+    for mode, scores in groups.items():
+        for start in range(0, len(scores), max_scores):
+            chunk = scores[start : start + max_scores]
+            if part and part_size + len(chunk) > max_scores:
+                parts.append(part)
+                part, part_size = {}, 0
+            part[mode] = chunk
+            part_size += len(chunk)
+    if part:
+        parts.append(part)
+    return parts
@@ -0,0 +1,95 @@
+import logging
+import socket
+from sqlalchemy import Engine, text
+
+STATEMENT_CREATE_SHARDS = """
+CREATE TABLE IF NOT EXISTS nyamatrix_shards (
+    run_id VARCHAR(64) NOT NULL,
+    shard_index INT NOT NULL,
+    shard_count INT NOT NULL,
+    host VARCHAR(255) NOT NULL,
+    started_at DATETIME NOT NULL,
+    finished_at DATETIME NULL,
+    aggregated_at DATETIME NULL,
+    PRIMARY KEY (run_id, shard_index)
+)
+"""
+STATEMENT_START_SHARD = """
+INSERT INTO nyamatrix_shards (run_id, shard_index, shard_count, host, started_at)
+VALUES (:run_id, :shard_index, :shard_count, :host, NOW())
+ON DUPLICATE KEY UPDATE
+    shard_count = VALUES(shard_count), host = VALUES(host), started_at = NOW(), finished_at = NULL, aggregated_at = NULL
+"""
+# A shard rerun changes pp the earlier aggregation did not see, the whole run has to be aggregated again.
+STATEMENT_RESET_AGGREGATION = "UPDATE nyamatrix_shards SET aggregated_at = NULL WHERE run_id = :run_id"
+STATEMENT_LOCK_SHARDS = (
+    "SELECT shard_index, shard_count, finished_at, aggregated_at FROM nyamatrix_shards WHERE run_id = :run_id FOR UPDATE"
+)
+STATEMENT_FINISH_SHARD = "UPDATE nyamatrix_shards SET finished_at = NOW() WHERE run_id = :run_id AND shard_index = :shard_index"
+STATEMENT_CLAIM_AGGREGATION = "UPDATE nyamatrix_shards SET aggregated_at = NOW() WHERE run_id = :run_id"
+
+
+def parse_shard(value: str) -> tuple[int, int]:
+    """
+    Parse "INDEX/COUNT" (index counted from 0) into (index, count).
+    """
+    try:
+        index, count = (int(part) for part in value.split("/"))
+    except ValueError:
+        raise ValueError(f"Invalid shard {value!r}, expected INDEX/COUNT such as 0/4.")
+    if count < 1 or not 0 <= index < count:
+        raise ValueError(f"Invalid shard {value!r}, INDEX must be between 0 and COUNT - 1.")
+    return index, count
+
+
+class ShardCoordinator:
+    """
+    Tracks the shards of a multi node recalc in the nyamatrix_shards table, one row per shard of a run id.
+    Every host recalculates the scores of its shard (a CRC32 of the map md5, so a map's groups never span shards),
+    then reports completion. Reporting locks the run's rows, so exactly one shard, the last to finish,
+    sees every shard done and claims the status and user statistics aggregation, which covers all shards at once.
+    Registering a shard clears the claim of the whole run: the rerun shard aggregates again once it finishes,
+    whether its earlier run changed pp after the aggregation or the aggregating host crashed.
+    """
+
+    def __init__(self, engine: Engine, run_id: str, shard_index: int, shard_count: int):
+        self.engine = engine
+        self.params = {"run_id": run_id, "shard_index": shard_index, "shard_count": shard_count}
+
+    def start(self) -> None:
+        """
+        Register the shard as running, a restarted shard resets its earlier completion and the run's aggregation.
+        """
+        with self.engine.connect() as conn:
+            conn.execute(text(STATEMENT_CREATE_SHARDS))
+            conn.execute(text(STATEMENT_START_SHARD), {**self.params, "host": socket.gethostname()})
+            conn.execute(text(STATEMENT_RESET_AGGREGATION), self.params)
+            conn.commit()
+        logging.info(f"Running shard {self.params['shard_index']}/{self.params['shard_count']} of run {self.params['run_id']}.")
+
+    def finish(self) -> bool:
+        """
+        Report the shard done, returns whether this shard claimed the aggregation.
+        """
+        with self.engine.connect() as conn:
+            conn = conn.execution_options(isolation_level="READ COMMITTED")
+            with conn.begin():
+                shards = conn.execute(text(STATEMENT_LOCK_SHARDS), self.params).all()
+                conn.execute(text(STATEMENT_FINISH_SHARD), self.params)
+                counts = {shard_count for _, shard_count, _, _ in shards}
+                if counts != {self.params["shard_count"]}:
+                    logging.error(f"Shards of run {self.params['run_id']} disagree on the shard count ({sorted(counts)}), not aggregating.")
+                    return False
+                if any(aggregated_at is not None for _, _, _, aggregated_at in shards):
+                    return False
+                pending = sorted(
+                    set(range(self.params["shard_count"]))
+                    - {index for index, _, finished_at, _ in shards if finished_at is not None}
+                    - {self.params["shard_index"]}
+                )
+                if pending:
+                    logging.info(f"Shard done, waiting for shards {', '.join(map(str, pending))} to finish and aggregate.")
+                    return False
+                conn.execute(text(STATEMENT_CLAIM_AGGREGATION), self.params)
+        logging.info(f"Every shard of run {self.params['run_id']} is done, aggregating on this host.")
+        return True
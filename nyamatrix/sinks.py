@@ -0,0 +1,116 @@
+import csv
+import logging
+from pathlib import Path
+from typing import Any, Iterator, Optional
+
+# Result row: score id, map id, score mode, stored pp (None if unset), recalculated pp, star rating
+ResultRow = tuple[int, int, int, Optional[float], float, float]
+COLUMNS = ("score_id", "map_id", "mode", "old_pp", "new_pp", "star_rating")
+ARROW_SUFFIXES = (".arrow", ".feather", ".ipc")
+BATCH_SIZE = 65536
+
+
+def _pyarrow() -> Any:
+    try:
+        import pyarrow  # type: ignore[import-not-found]
+        import pyarrow.ipc  # type: ignore[import-not-found]
+        import pyarrow.parquet  # type: ignore[import-not-found]
+    except ImportError:
+        raise RuntimeError("Parquet and Arrow IPC files need pyarrow, install it (poetry install -E arrow) or use a .csv file.")
+    return pyarrow
+
+
+def _schema(pa: Any) -> Any:
+    return pa.schema(
+        [
+            ("score_id", pa.int64()),
+            ("map_id", pa.int32()),
+            ("mode", pa.int8()),
+            ("old_pp", pa.float64()),
+            ("new_pp", pa.float64()),
+            ("star_rating", pa.float64()),
+        ]
+    )
+
+
+class ResultSink:
+    """
+    Streams recalculated pp rows to a file instead of the scores table, for a dry run to diff and review offline.
+    The format follows the suffix: .csv, .parquet or .arrow/.feather/.ipc (Arrow IPC), the latter two need pyarrow.
+    Columnar formats are written one record batch at a time, so memory stays bounded by the batch size.
+    """
+
+    def __init__(self, path: str | Path, batch_size: int = BATCH_SIZE):
+        self.path = Path(path)
+        self.batch_size = batch_size
+        self.rows = 0
+        self._batch: list[ResultRow] = []
+        self._file: Any = None
+        self._csv: Any = None
+        self._writer: Any = None
+        self._pa: Any = None
+        suffix = self.path.suffix.lower()
+        if suffix == ".csv":
+            self._file = self.path.open("w", newline="")
+            self._csv = csv.writer(self._file)
+            self._csv.writerow(COLUMNS)
+        elif suffix == ".parquet":
+            self._pa = _pyarrow()
+            self._writer = self._pa.parquet.ParquetWriter(self.path, _schema(self._pa))
+        elif suffix in ARROW_SUFFIXES:
+            self._pa = _pyarrow()
+            self._writer = self._pa.ipc.new_file(self.path, _schema(self._pa))
+        else:
+            raise ValueError(f"Unknown result file format {suffix!r}, use .csv, .parquet or .arrow.")
+
+    def write(self, rows: list[ResultRow]) -> None:
+        self.rows += len(rows)
+        if self._csv is not None:
+            self._csv.writerows(rows)
+            return
+        self._batch.extend(rows)
+        if len(self._batch) >= self.batch_size:
+            self.flush()
+
+    def flush(self) -> None:
+        if self._csv is not None:
+            self._file.flush()
+            return
+        if not self._batch:
+            return
+        columns = list(zip(*self._batch))
+        self._writer.write_batch(self._pa.record_batch(columns, schema=_schema(self._pa)))
+        self._batch = []
+
+    def close(self) -> None:
+        self.flush()
+        if self._writer is not None:
+            self._writer.close()
+        if self._file is not None:
+            self._file.close()
+        logging.info(f"Wrote {self.rows} results to {self.path}.")
+
+
+def iter_results(path: str | Path) -> Iterator[ResultRow]:
+    """
+    Read back a file written by ResultSink, batch by batch.
+    """
+    path = Path(path)
+    suffix = path.suffix.lower()
+    if suffix == ".csv":
+        with path.open(newline="") as f:
+            reader = csv.reader(f)
+            next(reader, None)
+            for score_id, map_id, mode, old_pp, new_pp, stars in reader:
+                yield int(score_id), int(map_id), int(mode), float(old_pp) if old_pp else None, float(new_pp), float(stars)
+        return
+    pa = _pyarrow()
+    if suffix == ".parquet":
+        batches = pa.parquet.ParquetFile(path).iter_batches(batch_size=BATCH_SIZE, columns=list(COLUMNS))
+    elif suffix in ARROW_SUFFIXES:
+        reader = pa.ipc.open_file(path)
+        batches = (reader.get_batch(i) for i in range(reader.num_record_batches))
+    else:
+        raise ValueError(f"Unknown result file format {suffix!r}, use .csv, .parquet or .arrow.")
+    for batch in batches:
+        yield from zip(*(batch.column(name).to_pylist() for name in COLUMNS))
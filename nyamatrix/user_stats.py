@@ -0,0 +1,46 @@
+from itertools import groupby
+from operator import itemgetter
+from typing import Iterable, Iterator
+
+# Same weighting as the calculated CTE in qb.update_user_statistics_use_status.
+PP_WEIGHT = 0.95
+BONUS_PP_BASE = 0.9994
+BONUS_PP_MAX = 416.6667
+
+
+def weigh(scores: list[tuple[float, float]]) -> tuple[float, float]:
+    """
+    Total pp and weighted accuracy of one user's best scores as (pp, acc) pairs, sorted by pp descending.
+    """
+    weighted_pp = weighted_acc = total_weight = 0.0
+    weight = 1.0
+    for pp, acc in scores:
+        weighted_pp += weight * pp
+        weighted_acc += weight * acc
+        total_weight += weight
+        weight *= PP_WEIGHT
+    bonus_pp = (1 - BONUS_PP_BASE ** len(scores)) * BONUS_PP_MAX
+    return weighted_pp + bonus_pp, (weighted_acc / total_weight if total_weight else 0.0)
+
+
+def iter_user_stats(
+    keys: Iterable[tuple[int, int]],
+    scores: Iterable[tuple[int, int, float, float]],
+) -> Iterator[tuple[int, int, float, float]]:
+    """
+    Merge the ordered (user id, mode) stats keys with the ordered (user id, mode, pp, acc) best scores stream,
+    yielding (user id, mode, pp, acc) for every key. Keys without scores get zeroes, like the COALESCE in the SQL engine.
+    Only one user's scores are held in memory at a time.
+    """
+    computed = (
+        (key, weigh([(pp, acc) for _, _, pp, acc in rows])) for key, rows in groupby(scores, key=itemgetter(0, 1))
+    )
+    current = next(computed, None)
+    for user_id, mode in keys:
+        key = (user_id, mode)
+        while current is not None and current[0] < key:
+            current = next(computed, None)
+        if current is not None and current[0] == key:
+            yield user_id, mode, *current[1]
+        else:
+            yield user_id, mode, 0.0, 0.0
@@ -0,0 +1,211 @@
+import json
+import logging
+import os
+import signal
+import threading
+from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Optional
+from redis import Redis
+from sqlalchemy import Engine, text
+
+from nyamatrix import enums, processor
+from nyamatrix.attr_cache import AttributeCache
+from nyamatrix.beatmaps import BeatmapIndex
+from nyamatrix.metrics import Metrics
+from nyamatrix.scores import iter_row_groups
+from nyamatrix.qb.new_scores import query as qb_new_scores, users as qb_new_score_users
+
+STATEMENT_MAX_SCORE_ID = "SELECT MAX(id) FROM scores"
+
+
+class Watcher:
+    """
+    Follows the scores table by id and recalculates newly submitted scores in small batches.
+    Each batch is recalculated with the beatmap index, the recently read .osu files and the attribute cache kept warm,
+    then only the batch's maps and users get their status picks, stats rows and leaderboard entries refreshed.
+    The id watermark is saved to a state file after every batch, so a restarted watch continues where it stopped.
+    Scores of maps that failed or had no .osu file are kept in a retry set (saved with the watermark) and read again
+    with every batch until they succeed. Every scan reaches lookback ids below the watermark, so scores whose insert
+    committed after a later id was already seen are still picked up, the ids done within that overlap are skipped.
+    """
+
+    def __init__(
+        self,
+        engine: Engine,
+        redis: Redis,
+        map_path: str,
+        state_path: str | Path,
+        *,
+        score_modes: Optional[list[enums.BanchoPyMode]] = None,
+        attr_cache: Optional[AttributeCache] = None,
+        batch_size: int = 5000,
+        lookback: int = 1000,
+        workers: int = 4,
+        write_mode: enums.WriteMode = enums.WriteMode.Row,
+        pp_epsilon: Optional[float] = 0.001,
+        cached_maps: int = 2000,
+        metrics: Optional[Metrics] = None,
+    ):
+        self.engine = engine
+        self.redis = redis
+        self.state_path = Path(state_path)
+        self.score_modes = score_modes
+        self.modes = [int(mode.value) for mode in score_modes] if score_modes else None
+        self.attr_cache = attr_cache
+        self.batch_size = batch_size
+        self.lookback = lookback
+        self.write_mode = write_mode
+        self.pp_epsilon = pp_epsilon
+        self.cached_maps = cached_maps
+        self.metrics = metrics if metrics is not None else Metrics()
+        self.index = BeatmapIndex.scan(map_path)
+        self.beatmaps: OrderedDict[int, tuple[bytes, str]] = OrderedDict()
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="nyamatrix-watch")
+        self.stop = threading.Event()
+        self.watermark: int = 0
+        self.newest: int = 0
+        self.retry: set[int] = set()
+        self.seen: set[int] = set()
+
+    def load_watermark(self, from_id: Optional[int] = None) -> None:
+        """
+        Start after from_id if given, else after the saved watermark, else after the newest score (only new scores).
+        """
+        if from_id is not None:
+            self.watermark = from_id
+        elif self.state_path.exists():
+            state = json.loads(self.state_path.read_text())
+            self.watermark = state["score_id"]
+            self.retry = set(state.get("retry", []))
+        else:
+            with self.engine.connect() as conn:
+                self.watermark = conn.execute(text(STATEMENT_MAX_SCORE_ID)).scalar() or 0
+        logging.info(f"Watching scores after ID {self.watermark}, {len(self.retry)} scores to retry.")
+
+    def save_watermark(self) -> None:
+        partial = self.state_path.with_name(self.state_path.name + ".tmp")
+        partial.write_text(json.dumps({"score_id": self.watermark, "retry": sorted(self.retry)}))
+        os.replace(partial, self.state_path)
+
+    def read_beatmap(self, map_id: int) -> tuple[bytes, str] | None:
+        if (cached := self.beatmaps.get(map_id)) is not None:
+            self.beatmaps.move_to_end(map_id)
+            return cached
+        if map_id not in self.index and not self.index.refresh(map_id):
+            return None
+        self.beatmaps[map_id] = beatmap = self.index.read(map_id)
+        if len(self.beatmaps) > self.cached_maps:
+            self.beatmaps.popitem(last=False)
+        return beatmap
+
+    def poll(self) -> int:
+        """
+        Recalculate the next batch of new scores, returns how many scores it covered.
+        """
+        with self.engine.connect() as conn:
+            self.newest = conn.execute(text(STATEMENT_MAX_SCORE_ID)).scalar() or 0
+        if self.newest <= self.watermark and not self.retry:
+            return 0
+        watermark = max(self.watermark, min(self.newest, self.watermark + self.batch_size))
+
+        with self.engine.connect() as conn:
+            query, query_params = qb_new_scores(
+                score_id_after=max(0, self.watermark - self.lookback),
+                score_id_upto=watermark,
+                score_ids=sorted(self.retry) or None,
+                score_modes=self.modes,
+            )
+            rows = (row for row in conn.execute(text(query), query_params) if row[2] not in self.seen)
+            batch = list(iter_row_groups(rows))
+
+        futures = []
+        missing = []
+        for map_id, groups, _ in batch:
+            if (beatmap := self.read_beatmap(map_id)) is None:
+                missing.append(map_id)
+                continue
+            futures.append(
+                (
+                    map_id,
+                    self.pool.submit(
+                        processor.process_map,
+                        map_id,
+                        groups,
+                        *beatmap,
+                        self.engine,
+                        self.attr_cache,
+                        self.write_mode,
+                        self.pp_epsilon,
+                    ),
+                )
+            )
+        failed = set(missing)
+        for map_id, future in futures:
+            map_stats = future.result()
+            self.metrics.observe_map(map_id, map_stats)
+            if map_stats["errors"]:
+                failed.add(map_id)
+        if missing:
+            self.metrics.inc("missing_maps", len(missing))
+            logging.warning(f"No .osu file for maps {', '.join(map(str, missing))}, their new scores will be retried.")
+
+        done: set[int] = set()
+        retry: set[int] = set()
+        for map_id, groups, _ in batch:
+            (retry if map_id in failed else done).update(score[0] for scores in groups.values() for score in scores)
+        done_maps = [map_id for map_id, _, _ in batch if map_id not in failed]
+        user_ids = []
+        if done:
+            with self.engine.connect() as conn:
+                users_query, users_params = qb_new_score_users(score_ids=sorted(done))
+                user_ids = [row[0] for row in conn.execute(text(users_query), users_params)]
+            # New scores can take a best pick whether their pp moved or not, so every map of the batch is rechecked.
+            processor.qb_process_score_status(
+                self.engine,
+                score_modes=self.score_modes,
+                user_ids=user_ids,
+                map_ids=done_maps,
+            )
+            processor.qb_process_user_statistics(
+                self.engine,
+                self.redis,
+                score_modes=self.score_modes,
+                calc_pp=True,
+                user_ids=user_ids,
+                stats_engine=enums.StatsEngine.Stream,
+            )
+        # Retried scores the query no longer returns (deleted or failed since) drop out of the set here.
+        self.retry = retry
+        self.watermark = watermark
+        self.seen = {score_id for score_id in self.seen | done if score_id > self.watermark - self.lookback}
+        self.save_watermark()
+        self.metrics.update(Counter(watch_batches=1, watch_scores=len(done), watch_users=len(user_ids)))
+        logging.info(
+            f"Recalculated {len(done)} new scores of {len(user_ids)} users, {len(retry)} to retry, "
+            f"watermark at score ID {self.watermark}."
+        )
+        return len(done)
+
+    def run(self, interval: float) -> None:
+        """
+        Poll until SIGINT/SIGTERM, sleeping interval seconds whenever the watch has caught up.
+        The running batch is always finished before exiting.
+        """
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(sig, lambda *_: self.stop.set())
+        while not self.stop.is_set():
+            try:
+                self.poll()
+                caught_up = self.watermark >= self.newest
+            except Exception as e:
+                logging.error(f"Watch batch after score ID {self.watermark} failed, retrying: {e}")
+                caught_up = True
+            self.metrics.write()
+            if caught_up:
+                if self.attr_cache:
+                    self.attr_cache.evict()
+                self.stop.wait(interval)
+        self.pool.shutdown(wait=True)
+        logging.info(f"Stopped watching at score ID {self.watermark}.")
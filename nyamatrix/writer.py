@@ -0,0 +1,91 @@
+from typing import Any, Sequence
+from sqlalchemy import Connection, text
+
+from nyamatrix import enums
+
+STATEMENT_UPDATE_SCORES = "UPDATE scores SET pp = :pp WHERE id = :id"
+STATEMENT_CREATE_STAGING = (
+    "CREATE TEMPORARY TABLE IF NOT EXISTS nyamatrix_pp_staging (id BIGINT UNSIGNED NOT NULL PRIMARY KEY, pp FLOAT NOT NULL)"
+)
+STATEMENT_INSERT_STAGING = "INSERT INTO nyamatrix_pp_staging (id, pp) VALUES (:id, :pp)"
+STATEMENT_APPLY_STAGING = "UPDATE scores s INNER JOIN nyamatrix_pp_staging t ON s.id = t.id SET s.pp = t.pp"
+STATEMENT_CLEAR_STAGING = "DELETE FROM nyamatrix_pp_staging"
+
+STATEMENT_UPDATE_STATS = "UPDATE stats SET pp = :pp, acc = :acc WHERE id = :id AND mode = :mode"
+STATEMENT_CREATE_STATS_STAGING = (
+    "CREATE TEMPORARY TABLE IF NOT EXISTS nyamatrix_stats_staging "
+    "(id INT UNSIGNED NOT NULL, mode TINYINT UNSIGNED NOT NULL, pp DOUBLE NOT NULL, acc DOUBLE NOT NULL, PRIMARY KEY (id, mode))"
+)
+STATEMENT_INSERT_STATS_STAGING = "INSERT INTO nyamatrix_stats_staging (id, mode, pp, acc) VALUES (:id, :mode, :pp, :acc)"
+STATEMENT_APPLY_STATS_STAGING = (
+    "UPDATE stats s INNER JOIN nyamatrix_stats_staging t ON s.id = t.id AND s.mode = t.mode SET s.pp = t.pp, s.acc = t.acc"
+)
+STATEMENT_CLEAR_STATS_STAGING = "DELETE FROM nyamatrix_stats_staging"
+
+
+def _write_staged(conn: Connection, params: list[dict], create: str, clear: str, insert: str, apply: str, chunk_size: int) -> None:
+    conn.execute(text(create))
+    for i in range(0, len(params), chunk_size):
+        # Cleared up front, a failed chunk may have left rows behind on this pooled connection.
+        conn.execute(text(clear))
+        conn.execute(text(insert), params[i : i + chunk_size])
+        conn.execute(text(apply))
+
+
+def write_scores_pp(
+    conn: Connection,
+    results: Sequence[tuple[Any, ...]],
+    mode: enums.WriteMode = enums.WriteMode.Row,
+    chunk_size: int = 10000,
+    commit: bool = True,
+) -> None:
+    """
+    Write (score id, pp, ...) results to the scores table and commit, extra fields are ignored.
+    Row mode runs one UPDATE per score. Bulk mode loads every chunk into a session temporary table with multi-row INSERTs
+    (the driver batches executemany INSERTs), then applies the chunk with a single UPDATE ... JOIN.
+    Without commit the caller owns the transaction, as the WriterStage does.
+    """
+    if not results:
+        return
+    params = [{"id": result[0], "pp": result[1]} for result in results]
+    if mode == enums.WriteMode.Row:
+        conn.execute(text(STATEMENT_UPDATE_SCORES), params)
+    else:
+        _write_staged(
+            conn,
+            params,
+            STATEMENT_CREATE_STAGING,
+            STATEMENT_CLEAR_STAGING,
+            STATEMENT_INSERT_STAGING,
+            STATEMENT_APPLY_STAGING,
+            chunk_size,
+        )
+    if commit:
+        conn.commit()
+
+
+def write_user_stats(
+    conn: Connection,
+    results: list[tuple[int, int, float, float]],
+    mode: enums.WriteMode = enums.WriteMode.Row,
+    chunk_size: int = 10000,
+) -> None:
+    """
+    Write (user id, mode, pp, acc) rows to the stats table and commit, see write_scores_pp for the modes.
+    """
+    if not results:
+        return
+    params = [{"id": user_id, "mode": user_mode, "pp": pp, "acc": acc} for user_id, user_mode, pp, acc in results]
+    if mode == enums.WriteMode.Row:
+        conn.execute(text(STATEMENT_UPDATE_STATS), params)
+    else:
+        _write_staged(
+            conn,
+            params,
+            STATEMENT_CREATE_STATS_STAGING,
+            STATEMENT_CLEAR_STATS_STAGING,
+            STATEMENT_INSERT_STATS_STAGING,
+            STATEMENT_APPLY_STATS_STAGING,
+            chunk_size,
+        )
+    conn.commit()